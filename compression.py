@@ -0,0 +1,251 @@
+'''
+Compressed input and output files
+
+Text and votable exports can be compressed on the fly with gzip, bz2, xz
+or zstd, chosen explicitly or from the output file extension. With several
+threads, data are cut into blocks compressed independently and written in
+order as concatenated members, which gzip, bzip2, xz and zstd readers accept.
+Compressed votables are read back with all their members.
+'''
+import bz2
+import collections
+import gzip
+import zlib
+import multiprocessing.pool
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+import config as cfg
+
+__author__ = "Nicolas Moreau"
+__copyright__ = "Copyright 2012"
+__credits__ = ["Nicolas Moreau"]
+__license__ = "GPL"
+__version__ = "1.0"
+__maintainer__ = "Nicolas Moreau"
+__email__ = "nicolas.moreau@obspm.fr"
+__status__ = "Development"  
+
+#file extension of each compression
+extensions = {'gz':'gzip', 'bz2':'bz2', 'xz':'xz', 'zst':'zstd'}
+
+
+def getCompression(filename, compression=None):
+    """
+        returns the compression to use for filename, given explicitly
+        or guessed from the file extension, None for plain files
+    """
+    if compression is not None:
+        if compression == 'none':
+            return None
+        if compression not in extensions.values():
+            raise Exception("unknown compression : "+compression)
+        return compression
+    return extensions.get(filename.rsplit('.', 1)[-1])
+
+
+def isAvailable(compression):
+    """
+        True if the module needed by compression can be imported
+    """
+    if compression == 'xz':
+        return lzma is not None
+    if compression == 'zstd':
+        return zstandard is not None
+    return True
+
+
+def compressBlock(data, compression):
+    """
+        returns data compressed as a complete stream
+    """
+    if compression == 'gzip':
+        compressor = zlib.compressobj(cfg.compressionLevel, zlib.DEFLATED, 16+zlib.MAX_WBITS)
+        return compressor.compress(data)+compressor.flush()
+    if compression == 'bz2':
+        return bz2.compress(data)
+    if compression == 'xz':
+        return lzma.compress(data)
+    return zstandard.ZstdCompressor().compress(data)
+
+
+def openOutput(filename, compression=None, threads=1, binary=False):
+    """
+        returns a file object open for writing, compressed according to 
+        compression or the extension of filename
+        threads : number of threads compressing blocks
+        binary : open an uncompressed file in binary mode
+    """
+    compression = getCompression(filename, compression)
+    if compression is None:
+        if binary:
+            return open(filename, 'wb')
+        return open(filename, 'w')
+    if not isAvailable(compression):
+        raise Exception(compression+" compression is not available")
+    if threads > 1:
+        return ParallelCompressedFile(filename, compression, threads)
+    if compression == 'gzip':
+        return gzip.GzipFile(filename, 'wb', cfg.compressionLevel)
+    if compression == 'bz2':
+        return bz2.BZ2File(filename, 'w')
+    if compression == 'xz':
+        return lzma.LZMAFile(filename, 'w')
+    return ZstdFile(filename)
+
+
+def openInput(filename, compression=None):
+    """
+        returns a binary file object open for reading, decompressed
+        according to compression or the extension of filename
+    """
+    compression = getCompression(filename, compression)
+    if compression is None:
+        return open(filename, 'rb')
+    if not isAvailable(compression):
+        raise Exception(compression+" compression is not available")
+    if compression == 'gzip':
+        return gzip.GzipFile(filename, 'rb')
+    if compression == 'bz2':
+        return Bz2Reader(filename)
+    if compression == 'xz':
+        return lzma.LZMAFile(filename, 'r')
+    return ZstdReader(filename)
+
+
+class ZstdFile(object):
+    """
+        file object writing a zstd stream
+    """
+    def __init__(self, filename):
+        self.f = open(filename, 'wb')
+        self.writer = zstandard.ZstdCompressor().stream_writer(self.f)
+
+    def write(self, data):
+        self.writer.write(data)
+
+    def close(self):
+        self.writer.flush(zstandard.FLUSH_FRAME)
+        self.f.close()
+
+
+class ParallelCompressedFile(object):
+    """
+        file object compressing blocks of cfg.compressionBlockSize bytes
+        in a pool of threads, blocks are written in order
+    """
+    def __init__(self, filename, compression, threads):
+        self.f = open(filename, 'wb')
+        self.compression = compression
+        self.threads = threads
+        self.pool = multiprocessing.pool.ThreadPool(threads)
+        #data not compressed yet
+        self.buffer = []
+        self.size = 0
+        #blocks being compressed, in order
+        self.pending = collections.deque()
+
+    def write(self, data):
+        self.buffer.append(data)
+        self.size += len(data)
+        if self.size >= cfg.compressionBlockSize:
+            self.__submit()
+
+    def __submit(self):
+        """
+            compress the buffered data in the pool
+        """
+        data = "".join(self.buffer)
+        self.buffer = []
+        self.size = 0
+        self.pending.append(self.pool.apply_async(compressBlock, (data, self.compression)))
+        #bound the number of blocks kept in memory
+        while len(self.pending) > 2*self.threads:
+            self.f.write(self.pending.popleft().get())
+
+    def close(self):
+        try:
+            if self.size > 0:
+                self.__submit()
+            while len(self.pending) > 0:
+                self.f.write(self.pending.popleft().get())
+        finally:
+            self.pool.terminate()
+            self.pool.join()
+            self.f.close()
+
+
+class Bz2Reader(object):
+    """
+        file object reading all the concatenated streams of a bz2 file,
+        bz2.BZ2File stops at the end of the first one
+    """
+    def __init__(self, filename):
+        self.f = open(filename, 'rb')
+        self.decompressor = bz2.BZ2Decompressor()
+        #decompressed data not read yet
+        self.buffer = []
+        self.size = 0
+
+    def read(self, size=-1):
+        while size < 0 or self.size < size:
+            data = self.f.read(cfg.compressionBlockSize)
+            if len(data) == 0:
+                break
+            self.__decompress(data)
+        data = "".join(self.buffer)
+        if size < 0:
+            size = len(data)
+        self.buffer = [data[size:]]
+        self.size = len(data)-size
+        return data[0:size]
+
+    def __decompress(self, data):
+        """
+            decompress data, starting a new decompressor at each stream
+        """
+        while len(data) > 0:
+            try:
+                result = self.decompressor.decompress(data)
+            except EOFError:
+                #previous stream ended with the previous read
+                self.decompressor = bz2.BZ2Decompressor()
+                continue
+            self.buffer.append(result)
+            self.size += len(result)
+            data = self.decompressor.unused_data
+            if len(data) > 0:
+                self.decompressor = bz2.BZ2Decompressor()
+
+    def close(self):
+        self.f.close()
+
+
+class ZstdReader(object):
+    """
+        file object reading all the frames of a zstd file
+    """
+    def __init__(self, filename):
+        self.f = open(filename, 'rb')
+        self.reader = zstandard.ZstdDecompressor().stream_reader(self.f, read_across_frames=True)
+
+    def read(self, size=-1):
+        if size >= 0:
+            return self.reader.read(size)
+        result = []
+        while True:
+            data = self.reader.read(cfg.compressionBlockSize)
+            if len(data) == 0:
+                return "".join(result)
+            result.append(data)
+
+    def close(self):
+        self.f.close()
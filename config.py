@@ -1,3 +1,4 @@
+import os
 applicationName="PDR Extractor"
 applicationDescription = 'Description here'
 inputFileExtension = 'hdf5'
@@ -8,7 +9,39 @@ txtFileExtension = 'txt'
 txtFileDescription = 'Text File'
 votableFileExtension = 'xml'
 votableFileDescription = 'Votable'
+npyFileExtension = 'npy'
+npyFileDescription = 'NumPy array'
+npzFileExtension = 'npz'
+npzFileDescription = 'NumPy archive'
+jsonFileExtension = 'json'
+parquetFileExtension = 'parquet'
+parquetFileDescription = 'Parquet'
+featherFileExtension = 'feather'
+featherFileDescription = 'Arrow IPC (Feather)'
+fitsFileExtension = 'fits'
+fitsFileDescription = 'FITS binary table'
 floatPrecision = 'float'
 doublePrecision = 'double'
+roundtripPrecision = 'roundtrip' # shortest values read back as the same double
+tabledataSerialization = 'TABLEDATA'
+binarySerialization = 'BINARY'
+binary2Serialization = 'BINARY2'
+votableSerialization = 'TABLEDATA' # serialization of the rows of votable exports
+templateCacheSize = 32 # votable headers and row templates kept for repeated exports
 separator = ',' # separator between columns while exporting
 internalSeparator = '#' # separator between group and dataset name for splitting
+indexCache = False # keep the index of each hdf file in indexCacheDirectory
+indexCacheDirectory = os.path.join(os.path.expanduser('~'), '.extractor', 'index') # one index file per hdf file path
+indexCacheExtension = 'idx' # extension of the index files
+lazyIndex = False # index the metadata of a dataset only when it is accessed
+memoryMap = True # read contiguous uncompressed datasets through a memory map
+columnCacheSize = 256*1024*1024 # maximum size in bytes of the extracted columns kept in memory, 0 to disable
+rowsDirective = '#rows:' # script line selecting exported rows, as start:stop:step
+filterDirective = '#filter:' # script line keeping the rows matching a condition, as dataset#name operator value
+blockRows = 65536 # rows read at once when a dataset is not chunked
+formatRows = 4096 # rows formatted at once when writing text
+streaming = True # exports read and write data by blocks of rows instead of whole columns
+subsetCompression = 'gzip' # compression of hdf subsets, gzip, lzf or None
+subsetChunkBytes = 1024*1024 # approximate size in bytes of a chunk in hdf subsets
+compressionLevel = 6 # level of gzip compression of text and votable output
+compressionBlockSize = 4*1024*1024 # bytes compressed at once by each thread in parallel compression
@@ -1,7 +1,67 @@
+import itertools
+import numpy
+
 def getValue(value, vtype):
     if vtype == "double":
         return "%.15e"%value
+    elif vtype == "roundtrip":
+        return repr(float(value))
     elif vtype == "float":
         return "%.6e"%value
     else:
         return value
+
+def getFormat(vtype):
+    """
+        returns the format string used by getValue for vtype
+    """
+    if vtype == "double":
+        return "%.15e"
+    elif vtype == "roundtrip":
+        #shortest string read back as the same double
+        return "%r"
+    elif vtype == "float":
+        return "%.6e"
+    else:
+        return "%s"
+
+def getColumnFormat(dtype, vtype, userformat=None):
+    """
+        returns the format of a column of type dtype,
+        userformat is used when given, strings are written as they are,
+        integers as integers and floating values with the precision of vtype
+    """
+    if userformat is not None:
+        return userformat
+    kind = numpy.dtype(dtype).kind
+    if kind in ('S', 'U', 'O'):
+        return "%s"
+    if kind in ('i', 'u', 'b'):
+        return "%d"
+    return getFormat(vtype)
+
+class BlockFormatter(object):
+    """
+        formats blocks of rows at once with a precompiled row format
+    """
+    def __init__(self, formats, separator, prefix='', suffix="\n"):
+        #format of one line, one format per column
+        escape = lambda text: text.replace('%', '%%')
+        self.row = escape(prefix)+escape(separator).join(formats)+escape(suffix)
+
+    def format(self, columns):
+        """
+            returns the text of the rows of columns, one line per row
+        """
+        if len(columns) == 0 or len(columns[0]) == 0:
+            return ''
+        values = [numpy.asarray(column).tolist() for column in columns]
+        #values of the block in row order
+        flat = tuple(itertools.chain.from_iterable(itertools.izip(*values)))
+        return (self.row*len(values[0]))%flat
+
+def formatBlock(formats, separator, columns):
+    """
+        formats a block of rows, used by worker processes
+    """
+    return BlockFormatter(formats, separator).format(columns)
@@ -1,7 +1,10 @@
 #!/usr/bin/python
-import gui
 import sys
+import os
+import glob
+import time
 import getopt
+import multiprocessing
 import hdf
 import config as cfg
 import util as u
@@ -21,10 +24,23 @@ def display_help():
         display help of the program
     """
     print '-h, --help : display this help\n\
--f, --file : HDF5 file to read\n\
+-f, --file : HDF5 file to read, a glob pattern or several -f start a batch\n\
+-L, --list : file listing HDF5 files to read, one per line, starts a batch\n\
 -t, --template : script to apply (.esf file)\n\
--o, --output : name of output file\n\
--s, --separator : separator between columns, default is ,'
+-o, --output : name of output file, in a batch a template using {stem}, {name} or {dir}\n\
+                of each HDF5 file, like {stem}.txt\n\
+-s, --separator : separator between columns, default is ,\n\
+-n, --nocache : do not use the index cache directory\n\
+--indexcache : keep the index of the HDF5 file in the cache directory for the next runs\n\
+-l, --lazy : index only the datasets used by the script\n\
+-j, --jobs : number of processes formatting text, or exporting files in a batch, default is 1\n\
+-F, --format : output format, txt, xml, npy, npz, hdf5, parquet, feather or fits, default is txt\n\
+-c, --compression : compression of hdf5 output, gzip, lzf or none, default is gzip\n\
+--shuffle : apply the shuffle filter on hdf5 output\n\
+-z, --compress : compression of txt, xml and fits output, gzip, bz2, xz, zstd or none, guessed from the output extension by default\n\
+--threads : number of threads compressing txt, xml and fits output, default is 1\n\
+-p, --precision : float, double or roundtrip, overrides the precision of the template\n\
+--serialization : serialization of xml output, TABLEDATA, BINARY or BINARY2, default is TABLEDATA'
 
 def error(message):
     """
@@ -36,18 +52,35 @@ def error(message):
 
 def main(argv):    
     try:                                
-        opts, args = getopt.getopt(argv, "hf:t:o:s:", ["help", "file=","template=", "output=", 'separator='])
+        opts, args = getopt.getopt(argv, "hf:L:t:o:s:nlj:F:c:z:p:", ["help", "file=", "list=","template=", "output=", 'separator=', 'nocache', 'indexcache', 'lazy', 'jobs=', 'format=', 'compression=', 'shuffle', 'compress=', 'threads=', 'precision=', 'serialization='])
     except getopt.GetoptError:          
         display_help()                         
         sys.exit(2)
 
     if len(opts) == 0:
+        #the command line does not need tk
+        import gui
         gui.TkFactory.buildMainFrame("800x600")        
     else:
-        hdffile = None
+        hdffiles = []
+        batch = False
         scriptfile = None
         outputfile = None
         separator = ","
+        indexcache = None
+        lazy = False
+        jobs = 1
+        fileformat = cfg.txtFileExtension
+        formats = [cfg.txtFileExtension, cfg.votableFileExtension, cfg.npyFileExtension, cfg.npzFileExtension, cfg.inputFileExtension,
+                   cfg.parquetFileExtension, cfg.featherFileExtension, cfg.fitsFileExtension]
+        compression = cfg.subsetCompression
+        shuffle = False
+        textcompression = None
+        threads = 1
+        precision = None
+        precisions = [cfg.floatPrecision, cfg.doublePrecision, cfg.roundtripPrecision]
+        serialization = cfg.votableSerialization
+        serializations = [cfg.tabledataSerialization, cfg.binarySerialization, cfg.binary2Serialization]
         
         for opt, arg in opts:       
             if opt in ("-h", "--help"):      
@@ -55,7 +88,20 @@ def main(argv):
                 sys.exit()     
                 
             if opt in ("-f", "--file"):
-                hdffile = arg
+                if glob.has_magic(arg):
+                    hdffiles.extend(sorted(glob.glob(arg)))
+                    batch = True
+                else:
+                    hdffiles.append(arg)
+                    
+            if opt in ("-L", "--list"):
+                try:
+                    f = open(arg)
+                    hdffiles.extend([line.strip() for line in f if len(line.strip()) > 0])
+                    f.close()
+                except IOError as e:
+                    error("Can not read file list : "+str(e))
+                batch = True
                 
             if opt in ("-t","--template"):
                 scriptfile = arg
@@ -66,7 +112,51 @@ def main(argv):
             if opt in ("-s","--separator"):
                 separator = arg
                 
-        if hdffile is None :         
+            if opt in ("-n","--nocache"):
+                indexcache = False
+                
+            if opt == "--indexcache":
+                indexcache = True
+                
+            if opt in ("-l","--lazy"):
+                lazy = True
+                
+            if opt in ("-j","--jobs"):
+                try:
+                    jobs = int(arg)
+                except ValueError:
+                    error("Number of jobs must be an integer")
+                    
+            if opt in ("-F","--format"):
+                fileformat = arg
+                
+            if opt in ("-c","--compression"):
+                compression = arg
+                if arg == 'none':
+                    compression = None
+                    
+            if opt == "--shuffle":
+                shuffle = True
+                
+            if opt in ("-z","--compress"):
+                textcompression = arg
+                
+            if opt == "--threads":
+                try:
+                    threads = int(arg)
+                except ValueError:
+                    error("Number of threads must be an integer")
+                    
+            if opt in ("-p","--precision"):
+                precision = arg
+                
+            if opt == "--serialization":
+                serialization = arg
+                
+        if len(hdffiles) > 1:
+            batch = True
+            
+        if len(hdffiles) == 0 :         
             error("HDF5 file is missing")            
         
         elif scriptfile is None : 
@@ -74,14 +164,137 @@ def main(argv):
             
         elif outputfile is None : 
             error("Output file name is missing")
+            
+        elif fileformat not in formats :
+            error("Unknown output format : "+fileformat)
+            
+        elif compression not in ('gzip', 'lzf', None) :
+            error("Unknown compression : "+compression)
+            
+        elif textcompression not in ('gzip', 'bz2', 'xz', 'zstd', 'none', None) :
+            error("Unknown compression : "+textcompression)
+            
+        elif precision not in precisions+[None] :
+            error("Unknown precision : "+precision)
+            
+        elif serialization not in serializations :
+            error("Unknown serialization : "+serialization)
+            
+        elif batch and not isTemplate(outputfile) :
+            error("Output file name must contain {stem}, {name} or {dir} in batch mode")
         
         else: 
-            precision, header = u.ScriptReader.getHeader(scriptfile)
-            if precision == cfg.doublePrecision:
-                isDouble = True
-            else: isDouble = False
-            
-            hdf.Exporter.exportAsText(hdf.PdrHDF(hdffile), header, u.ScriptReader.getColumns(scriptfile), outputfile, separator, isDouble)           
+            scriptprecision, header = u.ScriptReader.getHeader(scriptfile)
+            if precision is None:
+                precision = scriptprecision
+            options = {'header':header, 'columns':u.ScriptReader.getColumns(scriptfile), 
+                       'rows':u.ScriptReader.getRows(scriptfile), 'filters':u.ScriptReader.getFilters(scriptfile),
+                       'precision':precision, 'isDouble':precision == cfg.doublePrecision, 
+                       'fileformat':fileformat, 'separator':separator, 'indexcache':indexcache, 'lazy':lazy, 
+                       'jobs':jobs, 'compression':compression, 'shuffle':shuffle, 
+                       'textcompression':textcompression, 'threads':threads, 'serialization':serialization}
+            if batch:
+                #files are exported in parallel, each one by a single process
+                options['jobs'] = 1
+                if len(runBatch(hdffiles, outputfile, options, jobs)) > 0:
+                    sys.exit(1)
+            else:
+                export(hdffiles[0], outputfile, options)
+
+def getOutputName(template, hdffile):
+    """
+        returns the output file name of hdffile in a batch
+        template : output name using {stem}, {name} or {dir} of hdffile
+    """
+    name = os.path.basename(hdffile)
+    return template.format(stem=os.path.splitext(name)[0], name=name, dir=os.path.dirname(hdffile))
+
+def isTemplate(template):
+    """
+        returns True if template gives a different output name to each file
+    """
+    try:
+        return getOutputName(template, 'a/a.hdf5') != getOutputName(template, 'b/b.hdf5')
+    except (KeyError, IndexError, ValueError):
+        return False
+
+def export(hdffile, outputfile, options):
+    """
+        export the columns of the script from hdffile into outputfile
+        options : dictionary of the options of the command line and of the script
+    """
+    o = options
+    hdf5 = hdf.PdrHDF(hdffile, o['indexcache'], o['lazy'])
+    try:
+        if o['fileformat'] == cfg.votableFileExtension:
+            hdf.Exporter.exportAsVotable(hdf5, o['header'], o['columns'], outputfile, o['isDouble'], o['rows'], o['filters'], o['textcompression'], o['threads'], o['precision'], serialization=o['serialization'])
+        elif o['fileformat'] in (cfg.npyFileExtension, cfg.npzFileExtension):
+            hdf.Exporter.exportAsNumpy(hdf5, o['header'], o['columns'], outputfile, o['rows'], o['filters'], o['fileformat'])
+        elif o['fileformat'] == cfg.inputFileExtension:
+            hdf.Exporter.exportAsHdf(hdf5, o['columns'], outputfile, o['rows'], o['filters'], o['compression'], o['shuffle'])
+        elif o['fileformat'] == cfg.parquetFileExtension:
+            hdf.Exporter.exportAsParquet(hdf5, o['header'], o['columns'], outputfile, o['rows'], o['filters'])
+        elif o['fileformat'] == cfg.featherFileExtension:
+            hdf.Exporter.exportAsFeather(hdf5, o['header'], o['columns'], outputfile, o['rows'], o['filters'])
+        elif o['fileformat'] == cfg.fitsFileExtension:
+            hdf.Exporter.exportAsFits(hdf5, o['header'], o['columns'], outputfile, o['rows'], o['filters'], o['textcompression'], o['threads'])
+        else:
+            hdf.Exporter.exportAsText(hdf5, o['header'], o['columns'], outputfile, o['separator'], o['isDouble'], o['rows'], o['filters'], jobs=o['jobs'], compression=o['textcompression'], threads=o['threads'], precision=o['precision'], raiseErrors=True)           
+    finally:
+        hdf5.close()
+
+def exportFile(task):
+    """
+        export one file of a batch, errors are returned instead of raised
+        task : (hdffile, outputfile, options)
+        returns (hdffile, outputfile, seconds, error message or None)
+    """
+    hdffile, outputfile, options = task
+    start = time.time()
+    try:
+        export(hdffile, outputfile, options)
+    except Exception as e:
+        return hdffile, outputfile, time.time()-start, str(e) or e.__class__.__name__
+    return hdffile, outputfile, time.time()-start, None
+
+def runBatch(hdffiles, template, options, jobs=1):
+    """
+        export the script from each file of hdffiles with jobs processes,
+        a failing file is reported and does not stop the batch
+        template : output name using {stem}, {name} or {dir} of each file
+    """
+    tasks = [(hdffile, getOutputName(template, hdffile), options) for hdffile in hdffiles]
+    outputs = [task[1] for task in tasks]
+    if len(set(outputs)) != len(outputs):
+        error("Several files have the same output name, use {dir} in the output template")
+    start = time.time()
+    failures = []
+    read = 0
+    written = 0
+    pool = None
+    if jobs > 1:
+        pool = multiprocessing.Pool(jobs)
+        results = pool.imap_unordered(exportFile, tasks)
+    else:
+        results = (exportFile(task) for task in tasks)
+    try:
+        for hdffile, outputfile, seconds, message in results:
+            if message is not None:
+                failures.append(hdffile)
+                print 'failed : %s : %s' % (hdffile, message)
+                continue
+            read += os.path.getsize(hdffile)
+            written += os.path.getsize(outputfile)
+            print 'ok : %s -> %s (%.2fs)' % (hdffile, outputfile, seconds)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    elapsed = max(time.time()-start, 1e-6)
+    exported = len(tasks)-len(failures)
+    print '%d files exported, %d failed in %.2fs' % (exported, len(failures), elapsed)
+    print '%.2f files/s, %.2f MB/s read, %.2f MB/s written' % (exported/elapsed, read/elapsed/2**20, written/elapsed/2**20)
+    return failures
 
 
 if __name__ == "__main__":
@@ -0,0 +1,147 @@
+import numpy
+import votable as vot
+import compression as comp
+
+#size of fits blocks, headers and data are padded to a multiple of it
+blockSize = 2880
+#size of a header card
+cardSize = 80
+
+def getCard(keyword, value):
+    """
+        returns a header card of 80 characters
+        value : string, integer or boolean
+    """
+    if isinstance(value, bool):
+        value = ('T' if value else 'F').rjust(20)
+    elif isinstance(value, (int, long)):
+        value = str(value).rjust(20)
+    else:
+        #long strings are truncated inside the quotes
+        text = ''
+        for c in value:
+            c = c.replace("'", "''")
+            if len(text)+len(c) > cardSize-12:
+                break
+            text += c
+        value = "'"+text.ljust(8)+"'"
+    return (keyword.ljust(8)+'= '+value)[0:cardSize].ljust(cardSize)
+
+def getComment(text):
+    """
+        returns a COMMENT card
+    """
+    return ('COMMENT '+text)[0:cardSize].ljust(cardSize)
+
+def getPadding(size):
+    """
+        returns the number of bytes completing size to a multiple of blockSize
+    """
+    return (blockSize-size%blockSize)%blockSize
+
+class FitsTable(object):
+    """
+        fits file with an empty primary hdu and a BINTABLE extension,
+        fields are described by votable fields
+    """
+    def __init__(self):
+        self.fields = []
+        #numpy type of each field
+        self.dtypes = []
+        self.columns = []
+        #comment lines written in the extension header
+        self.comments = []
+
+    def addField(self, field, dtype=None):
+        """
+            add a votable field, values are written with dtype
+            or with the type given by the datatype of field if None
+        """
+        if isinstance(field, vot.Field):
+            if dtype is None:
+                dtype = vot.BinaryEncoder.getDtype(field)
+            self.fields.append(field)
+            self.dtypes.append(numpy.dtype(dtype))
+
+    def addColumn(self, data):
+        self.columns.append(data)
+
+    def addComment(self, text):
+        self.comments.append(text)
+
+    @staticmethod
+    def getFormat(dtype):
+        """
+            returns the TFORM code of the numpy type dtype
+        """
+        if dtype.kind == 'S':
+            return str(dtype.itemsize)+'A'
+        formats = {('u', 1):'B', ('i', 2):'I', ('i', 4):'J', ('i', 8):'K', ('f', 4):'E', ('f', 8):'D'}
+        if (dtype.kind, dtype.itemsize) not in formats:
+            raise Exception("type "+str(dtype)+" can not be written in fits")
+        return formats[(dtype.kind, dtype.itemsize)]
+
+    def getRowType(self):
+        """
+            returns the packed big endian type of a row
+        """
+        return numpy.dtype([('f'+str(i), self.dtypes[i].newbyteorder('>')) for i in range(0, len(self.dtypes))])
+
+    def getHeader(self, rows):
+        """
+            returns the primary header and the header of the table of rows rows
+        """
+        cards = [getCard('SIMPLE', True), getCard('BITPIX', 8), getCard('NAXIS', 0), getCard('EXTEND', True), 'END'.ljust(cardSize)]
+        result = ''.join(cards)
+        result += ' '*getPadding(len(result))
+        cards = [getCard('XTENSION', 'BINTABLE'), getCard('BITPIX', 8), getCard('NAXIS', 2),
+                 getCard('NAXIS1', self.getRowType().itemsize), getCard('NAXIS2', rows),
+                 getCard('PCOUNT', 0), getCard('GCOUNT', 1), getCard('TFIELDS', len(self.fields)),
+                 getCard('EXTNAME', 'results')]
+        for i in range(0, len(self.fields)):
+            field = self.fields[i]
+            n = str(i+1)
+            cards.append(getCard('TTYPE'+n, field.name))
+            cards.append(getCard('TFORM'+n, FitsTable.getFormat(self.dtypes[i])))
+            if field.unit is not None:
+                cards.append(getCard('TUNIT'+n, field.unit))
+            if field.ucd is not None:
+                cards.append(getCard('TUCD'+n, field.ucd))
+        for comment in self.comments:
+            cards.append(getComment(comment))
+        cards.append('END'.ljust(cardSize))
+        header = ''.join(cards)
+        return result+header+' '*getPadding(len(header))
+
+    def write(self, f, blocks, rows):
+        """
+            write the file in the open file f,
+            blocks is an iterable of lists of columns of rows rows in all
+        """
+        rowtype = self.getRowType()
+        f.write(self.getHeader(rows))
+        written = 0
+        for columns in blocks:
+            data = numpy.empty(len(columns[0]), dtype=rowtype)
+            for i in range(0, len(columns)):
+                data['f'+str(i)] = columns[i]
+            f.write(data.tostring())
+            written += len(data)
+        if written != rows:
+            raise Exception("expected "+str(rows)+" rows, "+str(written)+" written")
+        f.write('\0'*getPadding(written*rowtype.itemsize))
+
+    def toFile(self, filename, compression=None, threads=1):
+        """
+            write the table in filename
+            compression : gzip, bz2, xz, zstd or none, guessed from the file extension if None
+            threads : number of threads compressing the output
+        """
+        rows = 0
+        if len(self.columns) > 0:
+            rows = len(self.columns[0])
+        f = comp.openOutput(filename, compression, threads, True)
+        try:
+            self.write(f, [self.columns], rows)
+        finally:
+            f.close()
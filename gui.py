@@ -157,17 +157,18 @@ class SampWidget(object):
 
         self.frame.pack()  
         
-    def sendTable(self, filepath) :
+    def sendTable(self, filepath, mtype="table.load.votable") :
         """
-        send a votable
+        send a table
         filepath : url of the table
+        mtype : table.load.votable or table.load.fits
         """
         if self.client.isConnected() is False :  
             self.__connectHub()            
             
         if self.client.isConnected():  
             self.sentTableCount += 1
-            self.client.notifyAll({"samp.mtype": "table.load.votable",
+            self.client.notifyAll({"samp.mtype": mtype,
                                  "samp.params": {"url": "file:"+filepath, "name":self.name+" table "+str(self.sentTableCount)}})    
                                  
     def pack(self, position):
@@ -393,6 +394,12 @@ class MainFrame(object):
         
         self.exportedDataHeader = None
         
+        self.exportedRows = None
+        """ slice of exported rows, None for all the rows """
+        
+        self.exportedFilters = []
+        """ filters applied on exported rows, list of (dataset#name, operator, value) """
+        
         self.menuButton = None
         """ File menu in the menubar """
         
@@ -403,6 +410,12 @@ class MainFrame(object):
         
         self.precision = cfg.floatPrecision
         
+        self.serialization = cfg.votableSerialization
+        """ serialization of the rows of votable exports and SAMP tables """
+        
+        self.sampFormat = cfg.votableFileExtension
+        """ format of the tables sent with SAMP, xml or fits """
+        
         self.columnDescriptionText = None
         
         self.lastColumns = None
@@ -482,6 +495,9 @@ class MainFrame(object):
         self.exportvotablebutton = TkFactory.buildButton(bottomframe, "Export as Votable", self.__exportAsVotable)
         self.exportvotablebutton.pack(side=tk.LEFT)    
         
+        self.exportfitsbutton = TkFactory.buildButton(bottomframe, "Export as FITS", self.__exportAsFits)
+        self.exportfitsbutton.pack(side=tk.LEFT)    
+        
         self.exportscriptbutton = TkFactory.buildButton(bottomframe, "Save script", self.__saveScript)            
         self.exportscriptbutton.pack(side=tk.LEFT)       
         
@@ -520,11 +536,13 @@ class MainFrame(object):
         if status is True and self.exporttextbutton['state'] == tk.DISABLED : 
             self.exporttextbutton.config(state=tk.NORMAL)     
             self.exportvotablebutton.config(state=tk.NORMAL)     
+            self.exportfitsbutton.config(state=tk.NORMAL)     
             self.exportscriptbutton.config(state=tk.NORMAL)     
             self.sampbutton.config(state=tk.NORMAL)     
         elif status is False and self.exporttextbutton['state'] == tk.NORMAL:
             self.exporttextbutton.config(state=tk.DISABLED)     
             self.exportvotablebutton.config(state=tk.DISABLED)     
+            self.exportfitsbutton.config(state=tk.DISABLED)     
             self.exportscriptbutton.config(state=tk.DISABLED)     
             self.sampbutton.config(state=tk.DISABLED)     
 
@@ -564,6 +582,8 @@ class MainFrame(object):
         configurationMenuButton["menu"]=configurationMenuButton.menu
         configurationMenuButton.menu.add_command(label='Separator', command=self.__askChangeSeparator)        
         configurationMenuButton.menu.add_command(label='Precision', command=self.__askConfiguration)  
+        configurationMenuButton.menu.add_command(label='VOTable serialization', command=self.__askSerialization)  
+        configurationMenuButton.menu.add_command(label='SAMP table format', command=self.__askSampFormat)  
         configurationMenuButton.pack(side=tk.LEFT)   
         
         self.exportMenuButton = tk.Menubutton(menuContainer, text="Export")        
@@ -580,11 +600,25 @@ class MainFrame(object):
         
     def __askConfiguration(self):
         """
-        display widget for choice of precision (float or double)
+        display widget for choice of precision (float, double or roundtrip)
         """
-        d = RadioDialog(self.frame, [cfg.floatPrecision, cfg.doublePrecision], self.precision, "Precision configuration", "Choose precision")
+        d = RadioDialog(self.frame, [cfg.floatPrecision, cfg.doublePrecision, cfg.roundtripPrecision], self.precision, "Precision configuration", "Choose precision")
         self.precision = d.selectedvalue.get()
         
+    def __askSerialization(self):
+        """
+        display widget for choice of votable serialization (TABLEDATA, BINARY or BINARY2)
+        """
+        d = RadioDialog(self.frame, [cfg.tabledataSerialization, cfg.binarySerialization, cfg.binary2Serialization], self.serialization, "VOTable configuration", "Choose serialization")
+        self.serialization = d.selectedvalue.get()
+        
+    def __askSampFormat(self):
+        """
+        display widget for choice of the format of tables sent with SAMP (xml or fits)
+        """
+        d = RadioDialog(self.frame, [cfg.votableFileExtension, cfg.fitsFileExtension], self.sampFormat, "SAMP configuration", "Choose table format")
+        self.sampFormat = d.selectedvalue.get()
+        
     def __askDefaultColumn(self):
         """
         display widget for choosing the default exported column
@@ -631,6 +665,8 @@ class MainFrame(object):
         """
         self.exportedData = u.ScriptReader.getColumns(filename)
         self.precision, self.exportedDataHeader = u.ScriptReader.getHeader(filename)
+        self.exportedRows = u.ScriptReader.getRows(filename)
+        self.exportedFilters = u.ScriptReader.getFilters(filename)
         self.__exportAsText()
         self.__cleanSelection()
             
@@ -665,6 +701,8 @@ class MainFrame(object):
         del self.exportedData[:]
         self.__setButtonsState(False)    
         self.defaultColumnAdded = False     
+        self.exportedRows = None
+        self.exportedFilters = []
        
     def __addSelectedData(self, values):
         """
@@ -701,6 +739,10 @@ class MainFrame(object):
         filename = tkFileDialog.asksaveasfilename(filetypes=[(cfg.scriptFileDescription,"*."+cfg.scriptFileExtension)])
         f = open(filename,'w')
         f.write('#precision:'+self.precision+"\n")
+        if self.exportedRows is not None:
+            f.write(u.ScriptReader.formatRows(self.exportedRows))
+        for rowfilter in self.exportedFilters:
+            f.write(u.ScriptReader.formatFilter(rowfilter))
         for value in self.exportedData:
             f.write(value+"\n")
         f.close()    
@@ -727,7 +769,7 @@ class MainFrame(object):
         if self.precision == cfg.floatPrecision:
             isDouble = False
 
-        hdf.Exporter.exportAsText(self.hdfData, self.exportedDataHeader, self.exportedData, filename, cfg.separator, isDouble)
+        hdf.Exporter.exportAsText(self.hdfData, self.exportedDataHeader, self.exportedData, filename, cfg.separator, isDouble, self.exportedRows, self.exportedFilters, precision=self.precision)
         
     def __exportAsVotable(self): 
         """
@@ -740,7 +782,15 @@ class MainFrame(object):
         if self.precision == cfg.floatPrecision:
             isDouble = False
 
-        hdf.Exporter.exportAsVotable(self.hdfData, self.exportedDataHeader, self.exportedData, filename, isDouble)
+        hdf.Exporter.exportAsVotable(self.hdfData, self.exportedDataHeader, self.exportedData, filename, isDouble, self.exportedRows, self.exportedFilters, precision=self.precision, serialization=self.serialization)
+        
+    def __exportAsFits(self): 
+        """
+        export selected data into fits file
+        """
+        self.__appendMeshColumns()
+        filename = tkFileDialog.asksaveasfilename(filetypes=[(cfg.fitsFileDescription,"*."+cfg.fitsFileExtension)])
+        hdf.Exporter.exportAsFits(self.hdfData, self.exportedDataHeader, self.exportedData, filename, self.exportedRows, self.exportedFilters)
         
     def __appendMeshColumns(self):
         if self.__hasMeshOnly() and not self.defaultColumnAdded :
@@ -752,8 +802,13 @@ class MainFrame(object):
         isDouble = True
         if self.precision == cfg.floatPrecision:
             isDouble = False
+        if self.sampFormat == cfg.fitsFileExtension:
+            filename = os.path.expanduser("~/.extractor.fits")
+            hdf.Exporter.exportAsFits(self.hdfData, self.exportedDataHeader, self.exportedData, filename, self.exportedRows, self.exportedFilters)
+            self.sampWidget.sendTable(filename, "table.load.fits")
+            return
         filename = os.path.expanduser("~/.extractor.xml")
-        hdf.Exporter.exportAsVotable(self.hdfData, self.exportedDataHeader, self.exportedData, filename, isDouble)
+        hdf.Exporter.exportAsVotable(self.hdfData, self.exportedDataHeader, self.exportedData, filename, isDouble, self.exportedRows, self.exportedFilters, precision=self.precision, serialization=self.serialization)
         self.sampWidget.sendTable(filename)
         
         
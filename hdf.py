@@ -12,10 +12,25 @@ PathHDF5 | DataSet | Col.Index | PubID | HName  | DataType | Unit | SKOS | UCD |
 '''
 import h5py as h5
 import votable as vot
+import fits
 import numpy as numpy
+import os
+import hashlib
+import collections
+import itertools
+import operator
+import multiprocessing
+import json
+import numpy.lib.format as npformat
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
 import memory as m
 import config as cfg
 import convert as conv
+import compression as comp
 
 
 __author__ = "Nicolas Moreau"
@@ -83,6 +98,9 @@ class Pointer(object):
     """
         Points on data in a dataset
     """
+    __slots__ = ('path', 'dataset', 'name', 'column', 'ucd', 'skos', 'utype',
+                 'unit', 'description', 'objParent', 'group')
+
     def __init__(self):
         #dataset path
         self.path = None
@@ -100,25 +118,429 @@ class Pointer(object):
         self.objParent = None
         self.group = None
 
+
+class DatasetIndex(object):
+    """
+        columns of a dataset in a MetadataIndex,
+        pointers are built when accessed
+    """
+    def __init__(self, index, rows):
+        #MetadataIndex owning the rows
+        self.index = index
+        #rows[column_name] = row id in the metadata
+        self.rows = rows
+
+    def __getitem__(self, name):
+        return self.index.getPointer(self.rows[name])
+
+    def __contains__(self, name):
+        return name in self.rows
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def keys(self):
+        return self.rows.keys()
+
+    def values(self):
+        return [self[name] for name in self.rows]
+
+    def items(self):
+        return [(name, self[name]) for name in self.rows]
+
+
+class MetadataIndex(object):
+    """
+        compact index of the metadata, strings are interned and stored
+        as codes in a numpy structured array
+        index[dataset_name][column_name] = pointer
+        
+        in lazy mode, only the DataSet column is read at creation and
+        the rows of a dataset are indexed the first time it is accessed
+    """
+    #pointer attribute and its position in the metadata table
+    fields = [('path', 0), ('dataset', 1), ('column', 2), ('name', 4),
+              ('unit', 6), ('skos', 7), ('ucd', 8), ('utype', 9),
+              ('description', 10), ('objParent', 11), ('group', 12)]
+
+    def __init__(self, metadata=None, lazy=False):
+        #interned strings
+        self.strings = []
+        #code of each interned string
+        self.codes = {}
+        #one row per quantity, one code per pointer attribute
+        dtype = [(field, numpy.int32) for field, position in MetadataIndex.fields]
+        self.table = numpy.zeros(0, dtype=dtype)
+        #datasets[dataset_name][column_name] = row id
+        self.datasets = {}
+        #metadata rows of the datasets not indexed yet
+        self.pending = {}
+        #metadata source, only kept in lazy mode
+        self.source = None
+        if metadata is None:
+            return
+        self.table = numpy.zeros(len(metadata), dtype=dtype)
+        if lazy:
+            self.source = metadata
+            names = metadata[:, 1]
+            distinct, inverse = numpy.unique(names, return_inverse=True)
+            order = numpy.argsort(inverse, kind='mergesort')
+            bounds = numpy.cumsum(numpy.bincount(inverse, minlength=len(distinct)))
+            start = 0
+            for i in range(0, len(distinct)):
+                self.pending[distinct[i]] = order[start:bounds[i]]
+                start = bounds[i]
+        else:
+            self.__addRows(numpy.arange(len(metadata)), metadata)
+
+    @staticmethod
+    def fromArrays(table, strings, datasets, names, rows):
+        """
+            returns the index stored by getArrays
+        """
+        index = MetadataIndex()
+        index.table = table
+        index.strings = strings.tolist()
+        index.codes = dict([(index.strings[i], i) for i in range(0, len(index.strings))])
+        datasets = datasets.tolist()
+        names = names.tolist()
+        rows = rows.tolist()
+        for i in range(0, len(rows)):
+            if datasets[i] not in index.datasets:
+                index.datasets[datasets[i]] = {}
+            index.datasets[datasets[i]][names[i]] = rows[i]
+        return index
+
+    def getArrays(self):
+        """
+            returns the index as a dict of numpy arrays, 
+            the datasets of a lazy index must all be loaded
+        """
+        if len(self.pending) > 0:
+            raise Exception("the index is not complete")
+        datasets = []
+        names = []
+        rows = []
+        for dataset, columns in self.datasets.items():
+            for name, row in columns.items():
+                datasets.append(dataset)
+                names.append(name)
+                rows.append(row)
+        return {'table':self.table, 'strings':numpy.array(self.strings, dtype=str), 
+                'datasets':numpy.array(datasets, dtype=str), 'names':numpy.array(names, dtype=str), 
+                'rows':numpy.array(rows, dtype=numpy.int64)}
+
+    def __addRows(self, rows, lines):
+        """
+            index the metadata lines located at rows
+        """
+        codes = self.codes
+        for field, position in MetadataIndex.fields:
+            #values are interned one column at a time, without sorted copies
+            values = lines[:, position].tolist()
+            self.table[field][rows] = [codes[value] if value in codes else self.__intern(value) for value in values]
+        datasetNames = lines[:, 1].tolist()
+        names = lines[:, 4].tolist()
+        rows = rows.tolist()
+        for i in range(0, len(rows)):
+            if datasetNames[i] not in self.datasets:
+                self.datasets[datasetNames[i]] = {}
+            self.datasets[datasetNames[i]][names[i]] = rows[i]
+
+    def __intern(self, value):
+        """
+            returns the code of a string, adding it if needed
+        """
+        code = self.codes.get(value)
+        if code is None:
+            code = len(self.strings)
+            self.strings.append(value)
+            self.codes[value] = code
+        return code
+
+    def __load(self, dataset):
+        """
+            index the rows of a dataset in lazy mode
+        """
+        rows = self.pending.pop(dataset)
+        #rows of a dataset are usually adjacent, read their span at once
+        lines = self.source[int(rows[0]):int(rows[-1])+1]
+        self.__addRows(rows, lines[rows-rows[0]])
+
+    def isLoaded(self, dataset):
+        """
+            True if the rows of the dataset are indexed
+        """
+        return dataset in self.datasets
+
+    def __getitem__(self, dataset):
+        if dataset in self.pending:
+            self.__load(dataset)
+        return DatasetIndex(self, self.datasets[dataset])
+
+    def __contains__(self, dataset):
+        return dataset in self.datasets or dataset in self.pending
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.datasets)+len(self.pending)
+
+    def keys(self):
+        return self.datasets.keys()+self.pending.keys()
+
+    def getRow(self, dataset, name):
+        """
+            returns the metadata row id of a quantity
+        """
+        if dataset in self.pending:
+            self.__load(dataset)
+        return self.datasets[dataset][name]
+
+    def getPointer(self, row):
+        """
+            builds the pointer of a metadata row
+        """
+        codes = self.table[row]
+        p = Pointer()
+        for i in range(0, len(MetadataIndex.fields)):
+            setattr(p, MetadataIndex.fields[i][0], self.strings[codes[i]])
+        return p
+
+
+class ColumnCache(object):
+    """
+        least recently used cache of extracted columns,
+        bounded by the total size of the cached arrays in bytes
+    """
+    def __init__(self, size):
+        #maximum size in bytes, 0 disables the cache
+        self.size = size
+        #current size in bytes
+        self.used = 0
+        #columns[(path, dataset, column)] = numpy array, oldest first
+        self.columns = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """
+            returns the cached column or None
+        """
+        data = self.columns.pop(key, None)
+        if data is None:
+            self.misses += 1
+            return None
+        #move the column at the end of the queue
+        self.columns[key] = data
+        self.hits += 1
+        return data
+
+    def put(self, key, data):
+        """
+            add a column, removing the least recently used ones if needed,
+            the column is shared between callers and must not be modified
+        """
+        if data.nbytes > self.size:
+            return
+        if key in self.columns:
+            self.used -= self.columns.pop(key).nbytes
+        self.columns[key] = data
+        self.used += data.nbytes
+        while self.used > self.size:
+            oldKey, oldData = self.columns.popitem(last=False)
+            self.used -= oldData.nbytes
+
+    def peek(self, key):
+        """
+            returns the cached column or None, without updating
+            counters and recency
+        """
+        return self.columns.get(key)
+
+    def clear(self):
+        """
+            remove all the columns and reset counters
+        """
+        self.columns.clear()
+        self.used = 0
+        self.hits = 0
+        self.misses = 0
+
+
+class RowFilter(object):
+    """
+        comparison operators available in row filters
+    """
+    operators = {'<':operator.lt, '<=':operator.le, '>':operator.gt,
+                 '>=':operator.ge, '==':operator.eq, '!=':operator.ne}
+
+
+class ExtractionPlanner(object):
+    """
+        groups pointers by dataset so that each dataset is read only once
+    """
+    def __init__(self, pointers):
+        #pointers to extract, in output order
+        self.pointers = pointers
+        #(path, dataset) in order of first appearance
+        self.datasets = []
+        #groups[(path, dataset)] = positions of the pointers in the output
+        self.groups = {}
+        for i in range(0, len(pointers)):
+            key = (pointers[i].path, pointers[i].dataset)
+            if key not in self.groups:
+                self.datasets.append(key)
+                self.groups[key] = []
+            self.groups[key].append(i)
+
+    def getGroups(self):
+        """
+            returns a list of ((path, dataset), positions) tuples
+        """
+        return [(key, self.groups[key]) for key in self.datasets]
+
+    def getColumns(self, key):
+        """
+            returns the sorted column indexes to read in a dataset
+        """
+        columns = set()
+        for i in self.groups[key]:
+            columns.add(int(self.pointers[i].column))
+        return sorted(columns)
+
+
+class IndexCache(object):
+    """
+        index of a hdf file kept in a cache directory, stored as plain
+        numpy arrays so that loading it never runs code, and
+        invalidated when the file path, size, mtime or metadata shape change
+    """
+    version = 4
+
+    def __init__(self, filename, directory=None):
+        if directory is None:
+            directory = cfg.indexCacheDirectory
+        #absolute path of the hdf file
+        self.source = os.path.abspath(filename)
+        #cache file name, one per hdf file path
+        name = hashlib.md5(self.source).hexdigest()+'.'+cfg.indexCacheExtension
+        self.filename = os.path.join(directory, name)
+        stat = os.stat(filename)
+        self.size = stat.st_size
+        self.mtime = stat.st_mtime
+
+    def load(self, shape):
+        """
+            returns the cached index or None if missing or outdated
+            shape : shape of the metadata table of the hdf file
+        """
+        try:
+            f = open(self.filename, 'rb')
+            try:
+                content = numpy.load(f, allow_pickle=False)
+                if int(content['version']) != IndexCache.version:
+                    return None
+                if str(content['source']) != self.source:
+                    return None
+                if int(content['size']) != self.size or float(content['mtime']) != self.mtime:
+                    return None
+                if tuple(content['shape'].tolist()) != tuple(shape):
+                    return None
+                return MetadataIndex.fromArrays(content['table'], content['strings'], content['datasets'], 
+                                                content['names'], content['rows'])
+            finally:
+                f.close()
+        except Exception:
+            return None
+
+    def save(self, shape, index):
+        """
+            write the index in the cache directory, fails silently
+            if the directory is not writable
+        """
+        arrays = index.getArrays()
+        tmp = self.filename+'.tmp'
+        try:
+            directory = os.path.dirname(self.filename)
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            f = open(tmp, 'wb')
+            try:
+                numpy.savez(f, version=IndexCache.version, source=self.source, size=self.size, 
+                            mtime=self.mtime, shape=numpy.array(shape), **arrays)
+            finally:
+                f.close()
+            os.rename(tmp, self.filename)
+        except (IOError, OSError):
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
   
 class PdrHDF(object):
     """
         Access to a pdr HDF5 file
     """
-    def __init__(self, filename):
+    def __init__(self, filename, indexcache=None, lazy=None, memorymap=None, cachesize=None):
         #hdf file
         self.f =  h5.File(filename, 'r')
-        #create a pivoted array with the metadata
-        self.metadata = numpy.array(self.f['/Metadata/MetaData'])
+        #hdf file name, used to map datasets in memory
+        self.filename = filename
+        #map contiguous datasets in memory, default comes from configuration
+        if memorymap is None:
+            memorymap = cfg.memoryMap
+        self.memorymap = memorymap
+        #maps[dataset_name] = numpy.memmap, None if the dataset can not be mapped
+        self.maps = {}
+        #extracted columns, size in bytes comes from configuration by default
+        if cachesize is None:
+            cachesize = cfg.columnCacheSize
+        self.cache = ColumnCache(cachesize)
+        #build the index of a dataset only when it is used, default comes from configuration
+        if lazy is None:
+            lazy = cfg.lazyIndex
+        #use the index kept in the cache directory, default comes from configuration
+        if indexcache is None:
+            indexcache = cfg.indexCache
         #indexes all the data
         #index[dataset_name][column_name] = pointer
+        self.index = None
+        if lazy:
+            #metadata stay on disk, rows are read on demand
+            self.metadata = self.f['/Metadata/MetaData']
+            self.index = MetadataIndex(self.metadata, True)
+            return
+        if indexcache:
+            cache = IndexCache(filename)
+            shape = self.f['/Metadata/MetaData'].shape
+            self.index = cache.load(shape)
+            if self.index is not None:
+                #the metadata are not read, rows are read on demand
+                self.metadata = self.f['/Metadata/MetaData']
+                return
+        #create a pivoted array with the metadata
+        self.metadata = numpy.array(self.f['/Metadata/MetaData'])
         self.index = self.__buildIndex()
+        if indexcache:
+            cache.save(shape, self.index)
         
     def close(self):
         """
             close hdf file
         """
+        self.maps = {}
+        self.cache.clear()
         self.f.close()
+
+    def clearCache(self):
+        """
+            remove all the extracted columns kept in memory
+        """
+        self.cache.clear()
         
     def getByGroup(self, group):
         """
@@ -140,73 +562,459 @@ class PdrHDF(object):
         """
             creates the index
         """        
-        datasets = {}
-        for line in self.metadata:
-            if line[1] not in datasets : 
-                datasets[line[1]] = {}   
-            pf = PointerFactory()
-            pf.withPath(line[0]).withDataset(line[1])
-            pf.withName(line[4]).withColumn(line[2])
-            pf.withUnit(line[6]).withUcd(line[8])
-            pf.withSkos(line[7]).withUtype(line[9])
-            pf.withDescription(line[10]).withObjParent(line[11])
-            pf.withGroup(line[12]).getPointer()
-            datasets[line[1]][line[4]] = pf.getPointer()
-        return datasets
+        return MetadataIndex(self.metadata)
         
-    def extractQuantity(self, p):  
+    def __getMap(self, ds):
+        """
+            returns the dataset mapped in memory, or None if its layout
+            is not contiguous and unfiltered
+        """
+        if not self.memorymap:
+            return None
+        if ds.name in self.maps:
+            return self.maps[ds.name]
+        mapped = None
+        #chunked datasets are the only ones that can be filtered
+        if ds.chunks is None and ds.size > 0 and ds.dtype.kind in 'biuf':
+            offset = ds.id.get_offset()
+            if offset is not None:
+                #on disk byte order, may differ from the one returned by h5py
+                dtype = ds.id.get_type().dtype
+                mapped = numpy.memmap(self.filename, dtype=dtype, mode='r', offset=offset, shape=ds.shape)
+        self.maps[ds.name] = mapped
+        return mapped
+
+    def isMapped(self, p):
+        """
+            True if the data pointed by p are read from a memory map
+        """
+        return self.__getMap(self.f[p.path+'/'+p.dataset]) is not None
+
+    def __getRows(self, ds, rows):
+        """
+            returns the rows selection as a normalized slice or a sorted 
+            array of row indexes, None when all the rows are selected
+        """
+        if rows is None:
+            return None
+        if not isinstance(rows, slice):
+            return numpy.asarray(rows, dtype=numpy.int64)
+        start, stop, step = rows.indices(ds.shape[0])
+        if step < 1:
+            raise Exception("row step must be positive")
+        if start == 0 and stop == ds.shape[0] and step == 1:
+            return None
+        return slice(start, stop, step)
+
+    def __getKey(self, p, rows):
+        """
+            key of a column in the cache, None if the column is not cached
+        """
+        if rows is None:
+            return (p.path, p.dataset, p.column)
+        if isinstance(rows, slice):
+            return (p.path, p.dataset, p.column, rows.start, rows.stop, rows.step)
+        return None
+
+    def __read(self, ds, rows, columns=None):
+        """
+            read rows of a dataset
+            rows : normalized rows selection
+            columns : column index, slice or list of increasing column indexes 
+                      of a 2D dataset, None for a 1D dataset
+        """
+        if rows is None:
+            rows = slice(None)
+        if isinstance(rows, slice):
+            if columns is None:
+                return ds[rows]
+            return ds[rows, columns]
+        #coordinates selection, the rows are read by spans holding the selected
+        #rows of one chunk so that each chunk is read only once
+        shape = (len(rows),)
+        if isinstance(columns, slice):
+            shape += (len(range(*columns.indices(ds.shape[1]))),)
+        elif isinstance(columns, list):
+            shape += (len(columns),)
+        result = numpy.empty(shape, dtype=ds.dtype)
+        if len(rows) == 0:
+            return result
+        if ds.chunks is not None:
+            size = ds.chunks[0]
+        else:
+            size = cfg.blockRows
+        changes = numpy.flatnonzero(numpy.diff(rows // size))+1
+        bounds = [0]+changes.tolist()+[len(rows)]
+        for i in range(0, len(bounds)-1):
+            selected = rows[bounds[i]:bounds[i+1]]
+            first = int(selected[0])
+            last = int(selected[-1])+1
+            if columns is None:
+                block = ds[first:last]
+            else:
+                block = ds[first:last, columns]
+            result[bounds[i]:bounds[i+1]] = block[selected-first]
+        return result
+
+    def extractQuantity(self, p, rows=None):  
         """
             extract a quantity according to the pointer p
+            rows : slice of rows or sorted array of row indexes to extract, 
+                   all the rows if None, only the selected rows are read 
+                   from the file
+            returns a numpy array, a view on the file if the dataset can be 
+            mapped in memory
         """
         ds = self.f[p.path+'/'+p.dataset]
-        #1D array, returned directly
-        if len(ds.shape) == 1:
-            return ds
-        else :        
-            return [row[int(p.column)] for row in ds]
+        rows = self.__getRows(ds, rows)
+        selection = rows
+        if selection is None:
+            selection = slice(None)
+        mapped = self.__getMap(ds)
+        #views on the file cost nothing, they are not cached
+        if mapped is not None:
+            if len(ds.shape) == 1:
+                data = mapped[selection]
+            else:
+                data = mapped[selection, int(p.column)]
+            #row indexes give a copy of the mapped values
+            data.flags.writeable = False
+            return data
+        key = self.__getKey(p, rows)
+        data = None
+        if key is not None:
+            data = self.cache.get(key)
+        if data is None:
+            #1D array, read at once
+            if len(ds.shape) == 1:
+                data = self.__read(ds, rows)
+            else :
+                #read the column as a single hyperslab
+                data = self.__read(ds, rows, int(p.column))
+            #extracted arrays are read only whether they are cached or not
+            data.flags.writeable = False
+            if key is not None:
+                self.cache.put(key, data)
+        return data
+
+    def extractQuantities(self, pointers, rows=None):
+        """
+            extract several quantities, reading each dataset only once
+            rows : slice of rows or sorted array of row indexes to extract, 
+                   all the rows if None
+            returns a list of numpy arrays in the order of pointers
+        """
+        return self.__extractQuantities(pointers, rows, True)
+
+    def __extractQuantities(self, pointers, rows, usecache):
+        """
+            extract several quantities, the column cache is updated only 
+            if usecache is True, otherwise rows are only taken from
+            complete columns already cached
+        """
+        result = [None]*len(pointers)
+        #only the columns missing from the cache are read
+        missing = []
+        for i in range(0, len(pointers)):
+            p = pointers[i]
+            ds = self.f[p.path+'/'+p.dataset]
+            selection = self.__getRows(ds, rows)
+            if self.__getMap(ds) is None:
+                if usecache:
+                    key = self.__getKey(p, selection)
+                    if key is not None:
+                        result[i] = self.cache.get(key)
+                else:
+                    column = self.cache.peek(self.__getKey(p, None))
+                    if column is not None:
+                        if selection is None:
+                            selection = slice(None)
+                        result[i] = column[selection]
+                        result[i].flags.writeable = False
+            if result[i] is None:
+                missing.append(i)
+        planner = ExtractionPlanner([pointers[i] for i in missing])
+        for key, positions in planner.getGroups():
+            ds = self.f[key[0]+'/'+key[1]]
+            mapped = self.__getMap(ds)
+            if mapped is not None:
+                #views on the file, nothing to read
+                for i in positions:
+                    result[missing[i]] = self.extractQuantity(pointers[missing[i]], rows)
+                continue
+            selection = self.__getRows(ds, rows)
+            if len(ds.shape) == 1:
+                data = self.__read(ds, selection)
+                for i in positions:
+                    result[missing[i]] = data
+            else:
+                columns = planner.getColumns(key)
+                if len(columns) == 1:
+                    block = self.__read(ds, selection, slice(columns[0], columns[0]+1))
+                else:
+                    #h5py expects increasing indexes for fancy selection
+                    block = self.__read(ds, selection, columns)
+                for i in positions:
+                    j = columns.index(int(pointers[missing[i]].column))
+                    result[missing[i]] = numpy.ascontiguousarray(block[:, j])
+            for i in positions:
+                p = pointers[missing[i]]
+                #extracted arrays are read only whether they are cached or not
+                result[missing[i]].flags.writeable = False
+                cacheKey = self.__getKey(p, selection)
+                if cacheKey is not None and usecache:
+                    self.cache.put(cacheKey, result[missing[i]])
+        return result
+
+    def getDtype(self, p):
+        """
+            returns the numpy type of the data pointed by p
+        """
+        return self.f[p.path+'/'+p.dataset].dtype
+
+    def getSize(self, pointers):
+        """
+            returns the number of rows of the datasets of pointers,
+            raises an exception if they do not have the same size
+        """
+        size = None
+        for key, positions in ExtractionPlanner(pointers).getGroups():
+            length = self.f[key[0]+'/'+key[1]].shape[0]
+            if size is not None and length != size:
+                raise Exception('all the columns do not have the same size')
+            size = length
+        return size
+
+    def getRowCount(self, pointers, rows=None):
+        """
+            returns the number of rows selected in the datasets of pointers
+        """
+        size = self.getSize(pointers)
+        ds = self.f[pointers[0].path+'/'+pointers[0].dataset]
+        selection = self.__getRows(ds, rows)
+        if selection is None:
+            return size
+        if isinstance(selection, slice):
+            return len(range(*selection.indices(size)))
+        return len(selection)
+
+    def getBlockRows(self, pointers):
+        """
+            returns a number of rows per block aligned on the chunks of the 
+            datasets of pointers, so that each chunk is decompressed once
+        """
+        sizes = set()
+        for key, positions in ExtractionPlanner(pointers).getGroups():
+            ds = self.f[key[0]+'/'+key[1]]
+            if ds.chunks is not None:
+                sizes.add(ds.chunks[0])
+        if len(sizes) == 0:
+            return cfg.blockRows
+        #least common multiple of the chunk sizes
+        base = 1
+        for size in sizes:
+            a, b = base, size
+            while b:
+                a, b = b, a % b
+            base = base*size/a
+        if base > cfg.blockRows:
+            #chunks can not be aligned within the block size
+            return max(sizes)
+        return (cfg.blockRows/base)*base
+
+    def iterColumns(self, pointers, blockRows=None, rows=None):
+        """
+            generator extracting the quantities of pointers by blocks of rows,
+            yields a list of numpy arrays in the order of pointers
+            blockRows : number of rows per block in the file, aligned on the 
+                        chunks of the datasets by default
+            rows : slice of rows or sorted array of row indexes to extract, 
+                   all the rows if None
+        """
+        if len(pointers) == 0:
+            return
+        size = self.getSize(pointers)
+        if blockRows is None:
+            blockRows = self.getBlockRows(pointers)
+        ds = self.f[pointers[0].path+'/'+pointers[0].dataset]
+        selection = self.__getRows(ds, rows)
+        for first in xrange(0, size, blockRows):
+            last = min(first+blockRows, size)
+            if selection is None:
+                block = slice(first, last)
+            elif isinstance(selection, slice):
+                start = selection.start
+                if first > start:
+                    start += -((start-first)//selection.step)*selection.step
+                block = slice(start, min(last, selection.stop), selection.step)
+                if block.start >= block.stop:
+                    continue
+            else:
+                bounds = numpy.searchsorted(selection, [first, last])
+                block = selection[bounds[0]:bounds[1]]
+                if len(block) == 0:
+                    continue
+            yield self.__extractQuantities(pointers, block, False)
+
+    def selectRows(self, filters, rows=None):
+        """
+            returns the sorted indexes of the rows matching all the filters
+            filters : list of (dataset#name, operator, value) tuples
+            rows : slice of rows the filters are applied on, all the rows if None
+        """
+        pointers = []
+        for column, operator, value in filters:
+            parts = column.split(cfg.internalSeparator)
+            pointers.append(self.index[parts[0]][parts[1]])
+        #predicate columns are read first
+        values = self.extractQuantities(pointers, rows)
+        mask = None
+        for i in range(0, len(filters)):
+            matching = RowFilter.operators[filters[i][1]](values[i], filters[i][2])
+            if mask is None:
+                mask = matching
+            else:
+                mask &= matching
+        ds = self.f[pointers[0].path+'/'+pointers[0].dataset]
+        selection = self.__getRows(ds, rows)
+        indexes = numpy.flatnonzero(mask)
+        if selection is None:
+            return indexes
+        if isinstance(selection, slice):
+            return selection.start+indexes*selection.step
+        return selection[indexes]
  
         
-class Writer(object):
+class StreamWriter(object):
     """
-        write extracted data in a file
+        base of the writers reading the columns of their pointers by blocks
+        of rows, subclasses write the blocks in writeBlocks
     """
-    def __init__(self, filename, header=None, separator=',', isdouble=False):
+    def __init__(self, filename):
         #output file name
         self.filename = filename
         #a list of pointers
         self.pointers = []
+
+    def addPointer(self, pointer):
+        """
+            add the pointer of an exported column
+        """
+        self.pointers.append(pointer)
+
+    def stream(self, hdf5, rows=None, blockRows=None):
+        """
+            write the columns of the pointers, reading them by blocks of rows
+            rows : slice of rows or sorted array of row indexes, all the rows if None
+            blockRows : number of rows per block, aligned on hdf chunks by default
+        """
+        if len(self.pointers) == 0:
+            raise Exception("no data")
+        size = hdf5.getRowCount(self.pointers, rows)
+        self.writeBlocks(hdf5, hdf5.iterColumns(self.pointers, blockRows, rows), size)
+
+    def writeBlocks(self, hdf5, blocks, size):
+        """
+            write the blocks of columns of hdf5, size rows in all
+        """
+        raise NotImplementedError()
+
+
+class Writer(StreamWriter):
+    """
+        write extracted data in a file
+    """
+    def __init__(self, filename, header=None, separator=',', isdouble=False, jobs=1, compression=None, threads=1, precision=None, raiseErrors=False):
+        StreamWriter.__init__(self, filename)
         #a list of columns
         self.columns = []
+        #format of each column, None for the format given by its type
+        self.formats = []
         #separator between values
         self.separator = separator
         #
         self.header = header
         # precision is .6 if False, .15 if True
         self.isDouble = isdouble
+        #float, double or roundtrip, overrides isDouble if not None
+        self.precision = precision
+        #number of processes formatting rows
+        self.jobs = jobs
+        #gzip, bz2, xz, zstd or none, guessed from the file extension if None
+        self.compression = compression
+        #number of threads compressing the output
+        self.threads = threads
+        #errors are raised instead of printed if True
+        self.raiseErrors = raiseErrors
         
-        
-        
-    def addColumn(self, pointer, column):
+    def addColumn(self, pointer, column, fmt=None):
         """
-            add a column of data and its pointer
+            add a column of data and its pointer,
+            fmt is an optional format like '%.3f' for its values
         """
         self.pointers.append(pointer)
         self.columns.append(column)
+        self.formats.append(fmt)
+        
+    def addPointer(self, pointer, fmt=None):
+        """
+            add the pointer of a column read while streaming,
+            fmt is an optional format like '%.3f' for its values
+        """
+        self.pointers.append(pointer)
+        self.formats.append(fmt)
         
     def clearColumns(self):
         self.pointers = []
         self.columns = []
+        self.formats = []
         
     def write(self):
         """
             write all data
         """        
         try:
-            precision = "float"
-            if self.isDouble:
-                precision = "double"
-            self.__columnsAreWritable()
-            f = open(self.filename, 'w')
+            self.__columnsAreWritable(self.columns)
+            self.__writeBlocks([self.columns], self.__getFormats(self.columns))
+        except Exception as e:
+            if self.raiseErrors:
+                raise
+            print e
+            
+    def stream(self, hdf5, rows=None, blockRows=None):
+        """
+            write the columns of the pointers added with addPointer,
+            reading and writing them by blocks of rows so that memory
+            does not depend on the file size
+            rows : slice of rows or sorted array of row indexes, all the rows if None
+            blockRows : number of rows per block, aligned on hdf chunks by default
+        """
+        try:
+            StreamWriter.stream(self, hdf5, rows, blockRows)
+        except Exception as e:
+            if self.raiseErrors:
+                raise
+            print e
+            
+    def writeBlocks(self, hdf5, blocks, size):
+        """
+            write the blocks, the formats are checked on the first block
+            before the output is opened
+        """
+        blocks = iter(blocks)
+        first = next(blocks, None)
+        if first is None:
+            self.__writeBlocks([], None)
+            return
+        self.__writeBlocks(itertools.chain([first], blocks), self.__getFormats(first))
+            
+    def __writeBlocks(self, blocks, formats):
+        """
+            write the header then the rows of each block of columns
+            formats : format of each column
+        """
+        f = comp.openOutput(self.filename, self.compression, self.threads)
+        try:
             result = ''
             if self.header is not None :
                 result += "".join(self.header)
@@ -214,63 +1022,556 @@ class Writer(object):
             for pointer in self.pointers : 
                 result+=pointer.name+self.separator
             f.write(result[0:len(result)-1]+"\n")
-            size = len(self.columns[0])
             
-            for i in range(0, size):                
-                values = [column[i] for column in self.columns]                
-                size = len(values)          
-                if isinstance(values[0],numpy.string_) is False:
-                    f.write(self.separator.join([conv.getValue(el, precision) for el in values]))
-                else:
-                    f.write(self.separator.join(values))
-                f.write("\n")              
+            pool = None
+            if self.jobs > 1:
+                pool = multiprocessing.Pool(self.jobs)
+            #formatted parts not written yet, in row order
+            pending = collections.deque()
+            try:
+                formatter = None
+                if formats is not None:
+                    formatter = conv.BlockFormatter(formats, self.separator)
+                for columns in blocks:
+                    size = len(columns[0])
+                    for first in xrange(0, size, cfg.formatRows):
+                        last = first+cfg.formatRows
+                        part = [column[first:last] for column in columns]
+                        if pool is None:
+                            f.write(formatter.format(part))
+                            continue
+                        part = [numpy.asarray(column) for column in part]
+                        pending.append(pool.apply_async(conv.formatBlock, (formats, self.separator, part)))
+                        #bound the number of parts kept in memory
+                        if len(pending) >= 2*self.jobs:
+                            f.write(pending.popleft().get())
+                while len(pending) > 0:
+                    f.write(pending.popleft().get())
+            finally:
+                if pool is not None:
+                    pool.terminate()
+                    pool.join()
+        finally:
             f.close()
-        except Exception as e:
-            print e
                 
         
-    def __columnsAreWritable(self):
+    def __getFormats(self, columns):
+        """
+            returns the format of each column from its type
+            or from the format given when it was added
+        """
+        precision = cfg.floatPrecision
+        if self.isDouble:
+            precision = cfg.doublePrecision
+        if self.precision is not None:
+            precision = self.precision
+        formats = []
+        for i in range(0, len(columns)):
+            first = numpy.asarray(columns[i][0:1])
+            fmt = conv.getColumnFormat(first.dtype, precision, self.formats[i])
+            #a user format must accept the values of its column
+            if len(first) > 0:
+                try:
+                    fmt % first.tolist()[0]
+                except (TypeError, ValueError):
+                    raise Exception("format "+fmt+" does not match column "+self.pointers[i].name)
+            formats.append(fmt)
+        return formats
+        
+    def __columnsAreWritable(self, columns):
         """
             check data validity
         """
-        if len(self.columns) != len(self.pointers):
+        if len(columns) != len(self.pointers):
             raise Exception("columns and pointers do not match")
         
-        if len(self.columns) > 0 :
-            size = len(self.columns[0])
-            for i in range(1, len(self.columns)):
-                if len(self.columns[i]) != size:
+        if len(columns) > 0 :
+            size = len(columns[0])
+            for i in range(1, len(columns)):
+                if len(columns[i]) != size:
                     raise Exception('all the columns do not have the same size')
             return True        
         raise Exception("no data")
         
+class VotableWriter(StreamWriter):
+    """
+        write extracted data in a votable file, the rows are formatted
+        and written by blocks while they are read
+    """
+    def __init__(self, filename, precision=cfg.floatPrecision, compression=None, threads=1, serialization=cfg.votableSerialization):
+        StreamWriter.__init__(self, filename)
+        #float, double or roundtrip
+        self.precision = precision
+        #TABLEDATA, BINARY or BINARY2
+        self.serialization = serialization
+        #gzip, bz2, xz, zstd or none, guessed from the file extension if None
+        self.compression = compression
+        #number of threads compressing the output
+        self.threads = threads
+
+    @staticmethod
+    def getField(pointer, datatype, name=None):
+        """
+            returns the votable field describing the column of pointer,
+            named name or the name of the quantity if None
+        """
+        if name is None:
+            name = pointer.name
+        builder = vot.FieldBuilder()
+        link = vot.LinkBuilder().withContentRole('type').withHref(pointer.skos).getLink()
+        return builder.withName(name).withUnit(pointer.unit).withUcd(pointer.ucd).withUtype(pointer.utype).withDatatype(datatype).withLink(link).getField()
+
+    def getTable(self):
+        """
+            returns a votable with the fields of the pointers and no data
+        """
+        table = vot.Votable()
+        table.serialization = self.serialization
+        datatype = self.precision
+        #roundtrip values are doubles written with as few digits as possible
+        if datatype == cfg.roundtripPrecision:
+            table.precision = datatype
+            datatype = cfg.doublePrecision
+        for pointer in self.pointers:
+            table.addField(VotableWriter.getField(pointer, datatype))
+        return table
+
+    def writeBlocks(self, hdf5, blocks, size):
+        """
+            write the votable header then the rows of each block
+        """
+        table = self.getTable()
+        f = comp.openOutput(self.filename, self.compression, self.threads)
+        try:
+            table.write(f, blocks, size)
+        finally:
+            f.close()
+
+
+class FitsWriter(StreamWriter):
+    """
+        write extracted data in a fits binary table, the values are 
+        written by blocks of rows with the types of the hdf file
+    """
+    def __init__(self, filename, header=None, compression=None, threads=1):
+        StreamWriter.__init__(self, filename)
+        #comment lines of the script
+        self.header = header
+        #gzip, bz2, xz, zstd or none, guessed from the file extension if None
+        self.compression = compression
+        #number of threads compressing the output
+        self.threads = threads
+
+    def getTable(self, hdf5):
+        """
+            returns a fits table with the fields of the pointers and no data
+        """
+        table = fits.FitsTable()
+        names = Exporter.getFieldNames(self.pointers)
+        for i in range(0, len(self.pointers)):
+            table.addField(VotableWriter.getField(self.pointers[i], None, names[i]), hdf5.getDtype(self.pointers[i]))
+        if self.header is not None:
+            for line in self.header:
+                table.addComment(line.strip().lstrip('#'))
+        return table
+
+    def writeBlocks(self, hdf5, blocks, size):
+        """
+            write the fits headers then the rows of each block
+        """
+        table = self.getTable(hdf5)
+        f = comp.openOutput(self.filename, self.compression, self.threads, True)
+        try:
+            table.write(f, blocks, size)
+        finally:
+            f.close()
+
+
+class NumpyWriter(StreamWriter):
+    """
+        write extracted data as a numpy structured array in a .npy or
+        .npz file, metadata of the columns are written in a json sidecar
+    """
+    def __init__(self, filename, header=None, fileformat=cfg.npyFileExtension):
+        StreamWriter.__init__(self, filename)
+        #comment lines of the script
+        self.header = header
+        #npy for a single array, npz for an archive
+        self.fileformat = fileformat
+
+    def getFieldNames(self):
+        """
+            returns the field names of the structured array
+        """
+        return Exporter.getFieldNames(self.pointers)
+
+    def writeBlocks(self, hdf5, blocks, size):
+        """
+            write the array header then the rows of each block, the npz
+            archive is written once all the blocks are read
+        """
+        names = self.getFieldNames()
+        dtype = numpy.dtype([(names[i], hdf5.getDtype(self.pointers[i])) for i in range(0, len(names))])
+        self.__writeMetadata(names)
+        if self.fileformat == cfg.npzFileExtension:
+            data = numpy.empty(size, dtype=dtype)
+            first = 0
+            for block in blocks:
+                last = first+len(block[0])
+                for i in range(0, len(names)):
+                    data[names[i]][first:last] = block[i]
+                first = last
+            f = open(self.filename, 'wb')
+            try:
+                numpy.savez(f, data=data)
+            finally:
+                f.close()
+            return
+        f = open(self.filename, 'wb')
+        try:
+            header = {'descr':npformat.dtype_to_descr(dtype), 'fortran_order':False, 'shape':(size,)}
+            npformat.write_array_header_1_0(f, header)
+            for block in blocks:
+                data = numpy.empty(len(block[0]), dtype=dtype)
+                for i in range(0, len(names)):
+                    data[names[i]] = block[i]
+                f.write(data.tostring())
+        finally:
+            f.close()
+
+    def __writeMetadata(self, names):
+        """
+            write units, ucds and other metadata of the fields in filename.json
+        """
+        columns = []
+        for i in range(0, len(names)):
+            p = self.pointers[i]
+            columns.append({'field':names[i], 'name':p.name, 'dataset':p.dataset, 'unit':p.unit,
+                            'ucd':p.ucd, 'utype':p.utype, 'skos':p.skos, 'description':p.description})
+        f = open(self.filename+'.'+cfg.jsonFileExtension, 'w')
+        try:
+            json.dump({'header':self.header, 'columns':columns}, f, indent=1)
+        finally:
+            f.close()
+
+
+class HdfWriter(StreamWriter):
+    """
+        write extracted data in a new hdf file readable by PdrHDF, with the
+        metadata rows of the exported quantities only
+    """
+    def __init__(self, filename, compression=cfg.subsetCompression, shuffle=False):
+        StreamWriter.__init__(self, filename)
+        #gzip, lzf or None
+        self.compression = compression
+        #apply the shuffle filter before compression
+        self.shuffle = shuffle
+
+    @staticmethod
+    def getChunkRows(size, rowbytes):
+        """
+            returns the number of rows of a chunk of about cfg.subsetChunkBytes
+        """
+        return max(1, min(size, cfg.subsetChunkBytes/max(1, rowbytes)))
+
+    def writeBlocks(self, hdf5, blocks, size):
+        """
+            create the datasets of the pointers then copy each block
+        """
+        planner = ExtractionPlanner(self.pointers)
+        out = h5.File(self.filename, 'w')
+        try:
+            #datasets[(path, dataset)] = (output dataset, list of source columns)
+            datasets = {}
+            for key, positions in planner.getGroups():
+                source = hdf5.f[key[0]+'/'+key[1]]
+                shape = (size,)
+                columns = None
+                if len(source.shape) > 1:
+                    columns = planner.getColumns(key)
+                    shape = (size, len(columns))
+                options = {}
+                if size > 0:
+                    rowbytes = source.dtype.itemsize*(1 if columns is None else len(columns))
+                    options['chunks'] = (HdfWriter.getChunkRows(size, rowbytes),)+shape[1:]
+                    if self.compression is not None:
+                        options['compression'] = self.compression
+                    options['shuffle'] = self.shuffle
+                dataset = out.create_dataset(key[0]+'/'+key[1], shape, dtype=source.dtype, **options)
+                for name, value in source.attrs.items():
+                    dataset.attrs[name] = value
+                datasets[key] = (dataset, columns)
+            first = 0
+            for block in blocks:
+                last = first+len(block[0])
+                for key, positions in planner.getGroups():
+                    dataset, columns = datasets[key]
+                    if columns is None:
+                        dataset[first:last] = block[positions[0]]
+                        continue
+                    data = numpy.empty((last-first, len(columns)), dtype=dataset.dtype)
+                    for i in positions:
+                        data[:, columns.index(int(self.pointers[i].column))] = block[i]
+                    dataset[first:last] = data
+                first = last
+            self.__writeMetadata(hdf5, out, planner, datasets)
+        finally:
+            out.close()
+
+    def __writeMetadata(self, hdf5, out, planner, datasets):
+        """
+            copy the metadata rows of the exported quantities, with column
+            indexes of the new datasets
+        """
+        lines = []
+        for key, positions in planner.getGroups():
+            columns = datasets[key][1]
+            done = set()
+            for i in positions:
+                p = self.pointers[i]
+                if p.name in done:
+                    continue
+                done.add(p.name)
+                line = numpy.array(hdf5.metadata[hdf5.index.getRow(p.dataset, p.name)])
+                if columns is not None:
+                    line[2] = str(columns.index(int(p.column)))
+                lines.append(line)
+        out.create_dataset('/Metadata/MetaData', data=numpy.array(lines))
+        if '/Metadata/Metadata_ObjType' in hdf5.f:
+            hdf5.f.copy('/Metadata/Metadata_ObjType', out['/Metadata'])
+
+
+class ArrowWriter(StreamWriter):
+    """
+        write extracted data in a parquet file or an arrow ipc (feather) file,
+        pointer metadata are stored as field metadata
+    """
+    def __init__(self, filename, header=None, fileformat=cfg.parquetFileExtension):
+        StreamWriter.__init__(self, filename)
+        #comment lines of the script
+        self.header = header
+        #parquet or feather
+        self.fileformat = fileformat
+
+    def getSchema(self, hdf5):
+        """
+            returns the arrow schema of the exported columns
+        """
+        names = Exporter.getFieldNames(self.pointers)
+        fields = []
+        for i in range(0, len(names)):
+            p = self.pointers[i]
+            metadata = {}
+            for key, value in [('name', p.name), ('dataset', p.dataset), ('unit', p.unit), ('ucd', p.ucd),
+                               ('utype', p.utype), ('skos', p.skos), ('description', p.description)]:
+                if value is not None:
+                    metadata[key] = value
+            dtype = hdf5.getDtype(p).newbyteorder('=')
+            fields.append(pyarrow.field(names[i], pyarrow.from_numpy_dtype(dtype), metadata=metadata))
+        metadata = None
+        if self.header is not None:
+            metadata = {'header':"".join(self.header)}
+        return pyarrow.schema(fields, metadata=metadata)
+
+    def writeBlocks(self, hdf5, blocks, size):
+        """
+            write one row group or record batch per block of rows
+        """
+        if pyarrow is None:
+            raise Exception("pyarrow is required to export parquet and feather files")
+        schema = self.getSchema(hdf5)
+        if self.fileformat == cfg.parquetFileExtension:
+            writer = pyarrow.parquet.ParquetWriter(self.filename, schema)
+        else:
+            sink = pyarrow.OSFile(self.filename, 'wb')
+            writer = pyarrow.RecordBatchFileWriter(sink, schema)
+        try:
+            for block in blocks:
+                arrays = []
+                for i in range(0, len(block)):
+                    data = numpy.ascontiguousarray(block[i], dtype=block[i].dtype.newbyteorder('='))
+                    arrays.append(pyarrow.array(data, type=schema[i].type))
+                if self.fileformat == cfg.parquetFileExtension:
+                    writer.write_table(pyarrow.Table.from_arrays(arrays, schema=schema))
+                else:
+                    writer.write_batch(pyarrow.RecordBatch.from_arrays(arrays, schema=schema))
+        finally:
+            writer.close()
+            if self.fileformat != cfg.parquetFileExtension:
+                sink.close()
+
+
 class Exporter(object):
     @staticmethod
-    def exportAsText(hdf5, header, columns, outputfile, separator=",", isdouble=False): 
+    def getFieldNames(pointers):
+        """
+            returns unique column names, quantity names prefixed by their
+            dataset when they are not unique
+        """
+        names = [pointer.name for pointer in pointers]
+        result = []
+        for pointer in pointers:
+            name = pointer.name
+            if names.count(pointer.name) > 1:
+                name = pointer.dataset+cfg.internalSeparator+pointer.name
+            #same column exported several times
+            if name in result:
+                copy = 2
+                while name+cfg.internalSeparator+str(copy) in result:
+                    copy += 1
+                name += cfg.internalSeparator+str(copy)
+            result.append(name)
+        return result
+
+    @staticmethod
+    def getPointers(hdf5, columns):
+        """
+        returns the pointers of columns given as dataset#name strings
+        """
+        result = []
+        for column in columns:
+            parts = column.split(cfg.internalSeparator)
+            result.append(hdf5.index[parts[0]][parts[1]])
+        return result
+
+    @staticmethod
+    def addPointers(hdf5, w, columns):
+        """
+        add the pointers of columns given as dataset#name strings to the 
+        writer w, returns the pointers
+        """
+        pointers = Exporter.getPointers(hdf5, columns)
+        for pointer in pointers:
+            w.addPointer(pointer)
+        return pointers
+
+    @staticmethod
+    def getRows(hdf5, rows, filters):
+        """
+        returns the rows matching filters, rows if there is no filter
+        """
+        if filters:
+            return hdf5.selectRows(filters, rows)
+        return rows
+
+    @staticmethod
+    def stream(hdf5, w, columns, rows=None, filters=None):
+        """
+        write the columns given as dataset#name strings with the writer w,
+        by blocks of the rows matching filters
+        """
+        Exporter.addPointers(hdf5, w, columns)
+        w.stream(hdf5, Exporter.getRows(hdf5, rows, filters))
+
+    @staticmethod
+    def exportAsText(hdf5, header, columns, outputfile, separator=",", isdouble=False, rows=None, filters=None, streaming=None, jobs=1, compression=None, threads=1, formats=None, precision=None, raiseErrors=False): 
         """
         export selected data into text file
+        rows : slice of exported rows, all the rows if None
+        filters : list of (dataset#name, operator, value) row filters
+        streaming : write by blocks of rows, default comes from configuration
+        jobs : number of processes formatting rows
+        compression : gzip, bz2, xz, zstd or none, guessed from the file extension if None
+        threads : number of threads compressing the output
+        formats : optional dict of dataset#name -> format like '%.3f'
+        precision : float, double or roundtrip, overrides isdouble if not None
+        raiseErrors : raise writing errors instead of printing them
         """      
-        w = Writer(outputfile, header, separator, isdouble)
-        for i in range(0,len(columns)):
-            parts = columns[i].split(cfg.internalSeparator)
-            w.addColumn(hdf5.index[parts[0]][parts[1]], hdf5.extractQuantity(hdf5.index[parts[0]][parts[1]]))
+        w = Writer(outputfile, header, separator, isdouble, jobs, compression, threads, precision, raiseErrors)
+        pointers = Exporter.getPointers(hdf5, columns)
+        if formats is None:
+            formats = {}
+        rows = Exporter.getRows(hdf5, rows, filters)
+        if streaming is None:
+            streaming = cfg.streaming
+        if streaming:
+            for i in range(0,len(pointers)):
+                w.addPointer(pointers[i], formats.get(columns[i]))
+            w.stream(hdf5, rows)
+            return
+        data = hdf5.extractQuantities(pointers, rows)
+        for i in range(0,len(pointers)):
+            w.addColumn(pointers[i], data[i], formats.get(columns[i]))
         w.write()
         
     @staticmethod
-    def exportAsVotable(hdf5, header, columns, outputfile, isdouble=False): 
+    def exportAsVotable(hdf5, header, columns, outputfile, isdouble=False, rows=None, filters=None, compression=None, threads=1, precision=None, streaming=None, serialization=None): 
         """
-        export selected data into text file
+        export selected data into votable file
+        rows : slice of exported rows, all the rows if None
+        filters : list of (dataset#name, operator, value) row filters
+        compression : gzip, bz2, xz, zstd or none, guessed from the file extension if None
+        threads : number of threads compressing the output
+        precision : float, double or roundtrip, overrides isdouble if not None
+        streaming : write by blocks of rows, default comes from configuration
+        serialization : TABLEDATA, BINARY or BINARY2, default comes from configuration
+        """        
+        if serialization is None:
+            serialization = cfg.votableSerialization
+        if precision is None:
+            precision = cfg.floatPrecision
+            if isdouble : 
+                precision = cfg.doublePrecision
+        w = VotableWriter(outputfile, precision, compression, threads, serialization)
+        pointers = Exporter.addPointers(hdf5, w, columns)
+        rows = Exporter.getRows(hdf5, rows, filters)
+        if streaming is None:
+            streaming = cfg.streaming
+        if streaming:
+            w.stream(hdf5, rows)
+            return
+        table = w.getTable()
+        for column in hdf5.extractQuantities(pointers, rows):
+            table.addColumn(column)
+        table.toFile(outputfile, compression, threads)
+
+    @staticmethod
+    def exportAsNumpy(hdf5, header, columns, outputfile, rows=None, filters=None, fileformat=cfg.npyFileExtension): 
+        """
+        export selected data into a numpy .npy file, or a .npz archive if fileformat is npz
+        rows : slice of exported rows, all the rows if None
+        filters : list of (dataset#name, operator, value) row filters
+        """        
+        w = NumpyWriter(outputfile, header, fileformat)
+        Exporter.stream(hdf5, w, columns, rows, filters)
+
+    @staticmethod
+    def exportAsHdf(hdf5, columns, outputfile, rows=None, filters=None, compression=cfg.subsetCompression, shuffle=False): 
+        """
+        export selected data into a new hdf file
+        compression : gzip, lzf or None
+        shuffle : apply the shuffle filter before compression
+        """        
+        w = HdfWriter(outputfile, compression, shuffle)
+        Exporter.stream(hdf5, w, columns, rows, filters)
+
+    @staticmethod
+    def exportAsFits(hdf5, header, columns, outputfile, rows=None, filters=None, compression=None, threads=1): 
+        """
+        export selected data into a fits binary table
+        rows : slice of exported rows, all the rows if None
+        filters : list of (dataset#name, operator, value) row filters
+        compression : gzip, bz2, xz, zstd or none, guessed from the file extension if None
+        threads : number of threads compressing the output
         """        
-        table = vot.Votable()        
-        datatype='float'
-        if isdouble : 
-            datatype = 'double'
-        for i in range(0,len(columns)):
-            parts = columns[i].split(cfg.internalSeparator)
-            builder = vot.FieldBuilder()
-            field = hdf5.index[parts[0]][parts[1]]
-            link = vot.LinkBuilder().withContentRole('type').withHref(field.skos).getLink()
-            table.addField(builder.withName(field.name).withUnit(field.unit).withUcd(field.ucd).withUtype(field.utype).withDatatype(datatype).withLink(link).getField())
-            table.addColumn(hdf5.extractQuantity(hdf5.index[parts[0]][parts[1]]))
-        table.toFile(outputfile)
+        w = FitsWriter(outputfile, header, compression, threads)
+        Exporter.stream(hdf5, w, columns, rows, filters)
 
+    @staticmethod
+    def exportAsParquet(hdf5, header, columns, outputfile, rows=None, filters=None): 
+        """
+        export selected data into a parquet file
+        """        
+        Exporter.__exportAsArrow(hdf5, header, columns, outputfile, rows, filters, cfg.parquetFileExtension)
+
+    @staticmethod
+    def exportAsFeather(hdf5, header, columns, outputfile, rows=None, filters=None): 
+        """
+        export selected data into an arrow ipc (feather) file
+        """        
+        Exporter.__exportAsArrow(hdf5, header, columns, outputfile, rows, filters, cfg.featherFileExtension)
+
+    @staticmethod
+    def __exportAsArrow(hdf5, header, columns, outputfile, rows, filters, fileformat): 
+        w = ArrowWriter(outputfile, header, fileformat)
+        Exporter.stream(hdf5, w, columns, rows, filters)
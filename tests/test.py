@@ -1,11 +1,50 @@
 import sys
 sys.path.append('../')
 import unittest
+import numpy
+import h5py
+import os
+import shutil
+import tempfile
+import json
 import hdf
 import convert
 import config as cfg
 import votable as vot
+import fits
+import util
+import extractor
+import compression
+import gzip
+import bz2
+import base64
 
+class TemporaryTestCase(unittest.TestCase):
+    """
+        test case writing its files in a temporary directory
+    """
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        
+class WriterTestCase(TemporaryTestCase):
+    """
+        test case exporting test_file.hdf5 in the temporary directory
+    """
+    #name of the output file
+    output = 'output'
+    
+    def setUp(self):
+        TemporaryTestCase.setUp(self)
+        self.hdf = hdf.PdrHDF('test_file.hdf5')
+        self.filename = os.path.join(self.directory, self.output)
+        
+    def tearDown(self):
+        self.hdf.close()
+        TemporaryTestCase.tearDown(self)
+        
 class TestPointerFactory(unittest.TestCase):
     def setUp(self):
         factory = hdf.PointerFactory()
@@ -82,10 +121,434 @@ class TestConversion(unittest.TestCase):
         result = str(convert.getValue(1.0, cfg.doublePrecision))
         self.assertTrue(result == '1.000000000000000e+00')
         
-class TestPdrHDF(unittest.TestCase):
+    def test_roundtrip(self):
+        self.assertTrue(convert.getValue(1.0, cfg.roundtripPrecision) == '1.0')
+        values = numpy.array([0.1, 1.0/3, 2.5e-300, -1.7976931348623157e308])
+        formatter = convert.BlockFormatter([convert.getFormat(cfg.roundtripPrecision)], ',')
+        result = [float(value) for value in formatter.format([values]).split()]
+        self.assertTrue(numpy.array_equal(numpy.array(result), values))
+        
+    def test_blockFormatter(self):
+        columns = [numpy.array([1.0, 2.5e-300, -3.25]), numpy.array([4, 5, 6], dtype=numpy.float32)]
+        for precision in [cfg.floatPrecision, cfg.doublePrecision]:
+            expected = ''
+            for i in range(0, 3):
+                expected += '%'.join([convert.getValue(column[i], precision) for column in columns])+"\n"
+            formatter = convert.BlockFormatter([convert.getFormat(precision)]*2, '%')
+            self.assertTrue(formatter.format(columns) == expected)
+            
+    def test_columnFormat(self):
+        self.assertTrue(convert.getColumnFormat(numpy.dtype('S8'), cfg.doublePrecision) == '%s')
+        self.assertTrue(convert.getColumnFormat(numpy.dtype('int32'), cfg.doublePrecision) == '%d')
+        self.assertTrue(convert.getColumnFormat(numpy.dtype('float32'), cfg.floatPrecision) == '%.6e')
+        self.assertTrue(convert.getColumnFormat(numpy.dtype('float64'), cfg.doublePrecision) == '%.15e')
+        self.assertTrue(convert.getColumnFormat(numpy.dtype('float64'), cfg.doublePrecision, '%.2f') == '%.2f')
+        
+class TestWriter(WriterTestCase):
+    output = 'output.txt'
+    
+    def test_write(self):
+        pointers = [self.hdf.index['Abundances']['n(H2)'], self.hdf.index['Positions']['AV']]
+        columns = self.hdf.extractQuantities(pointers)
+        w = hdf.Writer(self.filename, ["#comment\n"], ';', True)
+        for i in range(0, len(pointers)):
+            w.addColumn(pointers[i], columns[i])
+        w.write()
+        expected = "#comment\n#n(H2);AV\n"
+        for i in range(0, len(columns[0])):
+            expected += ';'.join([convert.getValue(column[i], cfg.doublePrecision) for column in columns])+"\n"
+        f = open(self.filename)
+        self.assertTrue(f.read() == expected)
+        f.close()
+        
+    def test_stream(self):
+        pointers = [self.hdf.index['Abundances']['n(H2)'], self.hdf.index['Positions']['AV']]
+        rows = slice(3, 400, 2)
+        columns = self.hdf.extractQuantities(pointers, rows)
+        w = hdf.Writer(self.filename, None, ',', False)
+        for i in range(0, len(pointers)):
+            w.addColumn(pointers[i], columns[i])
+        w.write()
+        f = open(self.filename)
+        expected = f.read()
+        f.close()
+        self.hdf.clearCache()
+        w = hdf.Writer(self.filename, None, ',', False)
+        for pointer in pointers:
+            w.addPointer(pointer)
+        w.stream(self.hdf, rows, 64)
+        f = open(self.filename)
+        self.assertTrue(f.read() == expected)
+        f.close()
+        
+    def test_parallel(self):
+        pointers = [self.hdf.index['Abundances']['n(H2)'], self.hdf.index['Positions']['AV']]
+        outputs = []
+        for jobs in [1, 3]:
+            w = hdf.Writer(self.filename, None, ',', True, jobs)
+            for pointer in pointers:
+                w.addPointer(pointer)
+            w.stream(self.hdf, None, 50)
+            f = open(self.filename)
+            outputs.append(f.read())
+            f.close()
+        self.assertTrue(outputs[0] == outputs[1])
+        
+    def test_mixedTypes(self):
+        pointers = [self.hdf.index['Abundances']['n(H2)'], self.hdf.index['Positions']['AV'], self.hdf.index['Positions']['tau_V']]
+        w = hdf.Writer(self.filename, None, ',', False)
+        w.addColumn(pointers[0], numpy.array(['a', 'b'], dtype='S1'))
+        w.addColumn(pointers[1], numpy.array([1.5, 2.0]))
+        w.addColumn(pointers[2], numpy.array([3, 4]), '%03d')
+        w.write()
+        f = open(self.filename)
+        self.assertTrue(f.read() == "#n(H2),AV,tau_V\na,1.500000e+00,003\nb,2.000000e+00,004\n")
+        f.close()
+        
+    def test_roundtrip(self):
+        pointers = [self.hdf.index['Abundances']['n(H2)'], self.hdf.index['Positions']['AV']]
+        columns = self.hdf.extractQuantities(pointers)
+        w = hdf.Writer(self.filename, None, ',', True, precision=cfg.roundtripPrecision)
+        for pointer in pointers:
+            w.addPointer(pointer)
+        w.stream(self.hdf)
+        f = open(self.filename)
+        lines = f.readlines()[1:]
+        f.close()
+        for i in range(0, len(pointers)):
+            values = numpy.array([float(line.split(',')[i]) for line in lines])
+            self.assertTrue(numpy.array_equal(values, numpy.asarray(columns[i], dtype=numpy.float64)))
+        
+    def test_compressed(self):
+        pointers = [self.hdf.index['Abundances']['n(H2)'], self.hdf.index['Positions']['AV']]
+        w = hdf.Writer(self.filename, None, ',', True)
+        for pointer in pointers:
+            w.addPointer(pointer)
+        w.stream(self.hdf)
+        f = open(self.filename)
+        expected = f.read()
+        f.close()
+        blockSize = cfg.compressionBlockSize
+        cfg.compressionBlockSize = 1000
+        try:
+            for threads in [1, 3]:
+                filename = self.filename+'.gz'
+                w.filename = filename
+                w.threads = threads
+                w.stream(self.hdf)
+                f = gzip.open(filename)
+                self.assertTrue(f.read() == expected)
+                f.close()
+                w.filename = self.filename+'.out'
+                w.compression = 'bz2'
+                w.stream(self.hdf)
+                f = open(w.filename, 'rb')
+                data = f.read()
+                f.close()
+                result = ''
+                while len(data) > 0:
+                    decompressor = bz2.BZ2Decompressor()
+                    result += decompressor.decompress(data)
+                    data = decompressor.unused_data
+                self.assertTrue(result == expected)
+                w.compression = None
+        finally:
+            cfg.compressionBlockSize = blockSize
+        
+    def test_getCompression(self):
+        self.assertTrue(compression.getCompression('a.txt.gz') == 'gzip')
+        self.assertTrue(compression.getCompression('a.xml.zst') == 'zstd')
+        self.assertTrue(compression.getCompression('a.txt') is None)
+        self.assertTrue(compression.getCompression('a.txt.gz', 'none') is None)
+        self.assertTrue(compression.getCompression('a.txt', 'xz') == 'xz')
+        self.assertRaises(Exception, compression.getCompression, 'a.txt', 'rar')
+        
+class TestVotableWriter(WriterTestCase):
+    output = 'output.xml'
+    
+    def test_stream(self):
+        pointers = [self.hdf.index['Abundances']['n(H2)'], self.hdf.index['Positions']['AV']]
+        columns = self.hdf.extractQuantities(pointers)
+        table = vot.Votable()
+        for i in range(0, len(pointers)):
+            table.addField(hdf.VotableWriter.getField(pointers[i], cfg.doublePrecision))
+            table.addColumn(columns[i])
+        expected = table.getTable()
+        self.assertTrue(expected.count('<TR>') == len(columns[0]))
+        w = hdf.VotableWriter(self.filename, cfg.doublePrecision)
+        for pointer in pointers:
+            w.addPointer(pointer)
+        w.stream(self.hdf, None, 50)
+        f = open(self.filename)
+        self.assertTrue(f.read() == expected)
+        f.close()
+        
+    def test_binary(self):
+        pointers = [self.hdf.index['Abundances']['n(H2)'], self.hdf.index['Positions']['AV']]
+        columns = self.hdf.extractQuantities(pointers)
+        for serialization in [cfg.binarySerialization, cfg.binary2Serialization]:
+            w = hdf.VotableWriter(self.filename, cfg.floatPrecision, None, 1, serialization)
+            for pointer in pointers:
+                w.addPointer(pointer)
+            w.stream(self.hdf, None, 50)
+            f = open(self.filename)
+            document = f.read()
+            f.close()
+            self.assertTrue('<'+serialization+'>' in document)
+            stream = document.split('<STREAM encoding="base64">')[1].split('</STREAM>')[0]
+            types = [('n(H2)', '>f4'), ('AV', '>f4')]
+            if serialization == cfg.binary2Serialization:
+                types.insert(0, ('nulls', 'u1'))
+            data = numpy.frombuffer(base64.b64decode(''.join(stream.split())), dtype=numpy.dtype(types))
+            self.assertTrue(numpy.array_equal(data['n(H2)'], columns[0].astype(numpy.float32)))
+            self.assertTrue(numpy.array_equal(data['AV'], columns[1].astype(numpy.float32)))
+            
+    def test_read(self):
+        pointers = [self.hdf.index['Abundances']['n(H2)'], self.hdf.index['Positions']['AV']]
+        columns = self.hdf.extractQuantities(pointers)
+        for serialization in [cfg.tabledataSerialization, cfg.binarySerialization, cfg.binary2Serialization]:
+            w = hdf.VotableWriter(self.filename, cfg.roundtripPrecision, None, 1, serialization)
+            for pointer in pointers:
+                w.addPointer(pointer)
+            w.stream(self.hdf, None, 50)
+            table = vot.VotableReader.fromFile(self.filename)
+            self.assertTrue([field.name for field in table.fields] == ['n(H2)', 'AV'])
+            self.assertTrue(table.fields[1].unit == 'mag')
+            for i in range(0, len(pointers)):
+                self.assertTrue(table.columns[i].dtype == numpy.float64)
+                self.assertTrue(numpy.array_equal(table.columns[i], columns[i]))
+        
+    def test_readCompressed(self):
+        pointers = [self.hdf.index['Abundances']['n(H2)'], self.hdf.index['Positions']['AV']]
+        columns = self.hdf.extractQuantities(pointers)
+        blockSize = cfg.compressionBlockSize
+        #small blocks give files made of many concatenated members
+        cfg.compressionBlockSize = 4096
+        try:
+            for extension, name in compression.extensions.items():
+                if not compression.isAvailable(name):
+                    continue
+                for threads in [1, 3]:
+                    filename = self.filename+'.'+extension
+                    hdf.Exporter.exportAsVotable(self.hdf, None, ['Abundances#n(H2)', 'Positions#AV'], filename,
+                                                 threads=threads, precision=cfg.roundtripPrecision)
+                    table = vot.VotableReader.fromFile(filename)
+                    for i in range(0, len(pointers)):
+                        self.assertTrue(numpy.array_equal(table.columns[i], columns[i]))
+        finally:
+            cfg.compressionBlockSize = blockSize
+        
+    def test_readWithoutRowCount(self):
+        table = vot.Votable()
+        table.addField(vot.FieldBuilder().withName('a').withDatatype('double').getField())
+        table.addColumn(numpy.arange(3000.0))
+        table.columns[0][7] = numpy.nan
+        document = table.getTable().replace(' nrows="3000"', '').replace('<TD>nan</TD>', '<TD></TD>')
+        f = open(self.filename, 'w')
+        f.write(document)
+        f.close()
+        column = vot.VotableReader.fromFile(self.filename).columns[0]
+        self.assertTrue(len(column) == 3000)
+        self.assertTrue(numpy.isnan(column[7]))
+        self.assertTrue(column[2999] == 2999.0)
+        
+    def test_template(self):
+        tables = []
+        for unit in ['mag', 'mag', 'cm-3']:
+            table = vot.Votable()
+            table.addField(vot.FieldBuilder().withName('AV').withUnit(unit).withDatatype('double').getField())
+            tables.append(table)
+        vot.templates.clear()
+        self.assertTrue(tables[0].getFormatter() is tables[1].getFormatter())
+        self.assertTrue(tables[0].getTemplate()[1] is tables[1].getTemplate()[1])
+        self.assertTrue('<TABLE name="results" nrows="10">' in tables[0].getHeader(10))
+        self.assertTrue('unit="cm-3"' in tables[2].getHeader())
+        tables[1].serialization = cfg.binary2Serialization
+        self.assertTrue('<BINARY2>' in tables[1].getHeader())
+        self.assertTrue(len(vot.templates.templates) == 3)
+        
+    def test_nulls(self):
+        field = vot.FieldBuilder().withName('a').withDatatype('double').getField()
+        encoder = vot.BinaryEncoder([field], True)
+        data = base64.b64decode(encoder.format([numpy.array([1.0, numpy.nan])])+encoder.flush())
+        data = numpy.frombuffer(data, dtype=numpy.dtype([('nulls', 'u1'), ('a', '>f8')]))
+        self.assertTrue(list(data['nulls']) == [0, 128])
+        self.assertTrue(data['a'][0] == 1.0)
+        
+class TestFitsWriter(WriterTestCase):
+    output = 'output.fits'
+    
+    def test_export(self):
+        columns = ['Abundances#n(H2)', 'Positions#AV']
+        pointers = hdf.Exporter.getPointers(self.hdf, columns)
+        rows = slice(5, 300, 3)
+        expected = self.hdf.extractQuantities(pointers, rows)
+        hdf.Exporter.exportAsFits(self.hdf, ["#comment\n"], columns, self.filename, rows)
+        f = open(self.filename, 'rb')
+        content = f.read()
+        f.close()
+        self.assertTrue(len(content)%2880 == 0)
+        self.assertTrue(content.startswith('SIMPLE  =                    T'))
+        extension = content[2880:]
+        cards = [extension[i:i+80].rstrip() for i in range(0, 2880, 80)]
+        self.assertTrue("XTENSION= 'BINTABLE'" in cards)
+        self.assertTrue("NAXIS2  = "+str(len(expected[0])).rjust(20) in cards)
+        self.assertTrue("TTYPE1  = 'n(H2)   '" in cards)
+        self.assertTrue("TFORM2  = 'D       '" in cards)
+        self.assertTrue("TUNIT2  = 'mag     '" in cards)
+        self.assertTrue("COMMENT comment" in cards)
+        data = numpy.frombuffer(extension[2880:2880+16*len(expected[0])], dtype=numpy.dtype([('a', '>f8'), ('b', '>f8')]))
+        self.assertTrue(numpy.array_equal(data['a'], expected[0]))
+        self.assertTrue(numpy.array_equal(data['b'], expected[1]))
+        
+    def test_duplicateNames(self):
+        source = os.path.join(self.directory, 'duplicate.hdf5')
+        createFile(source, {'A':numpy.zeros((10, 2)), 'B':numpy.ones((10, 2))})
+        data = hdf.PdrHDF(source, False)
+        hdf.Exporter.exportAsFits(data, None, ['A#c0', 'B#c0'], self.filename)
+        data.close()
+        f = open(self.filename, 'rb')
+        extension = f.read()[2880:5760]
+        f.close()
+        cards = [extension[i:i+80].rstrip() for i in range(0, 2880, 80)]
+        self.assertTrue("TTYPE1  = 'A#c0    '" in cards)
+        self.assertTrue("TTYPE2  = 'B#c0    '" in cards)
+        
+    def test_getCard(self):
+        self.assertTrue(fits.getCard('TTYPE1', 'AV') == "TTYPE1  = 'AV      '".ljust(80))
+        for value in ['x'*100, 'x'*67+"'abc", "it's "*30]:
+            card = fits.getCard('TTYPE1', value)
+            self.assertTrue(len(card) == 80)
+            text = card[10:].rstrip()
+            self.assertTrue(text.startswith("'") and text.endswith("'"))
+            #quotes inside the value are doubled
+            self.assertTrue(len(text[1:-1].replace("''", "")) == len(text[1:-1].replace("'", "")))
+        
+class TestNumpyWriter(WriterTestCase):
+    def test_export(self):
+        columns = ['Abundances#n(H2)', 'Positions#AV']
+        pointers = hdf.Exporter.getPointers(self.hdf, columns)
+        rows = slice(5, 300, 3)
+        expected = self.hdf.extractQuantities(pointers, rows)
+        for fileformat in [cfg.npyFileExtension, cfg.npzFileExtension]:
+            filename = os.path.join(self.directory, 'output.'+fileformat)
+            hdf.Exporter.exportAsNumpy(self.hdf, None, columns, filename, rows, None, fileformat)
+            data = numpy.load(filename)
+            if fileformat == cfg.npzFileExtension:
+                data = data['data']
+            self.assertTrue(data.dtype.names == ('n(H2)', 'AV'))
+            self.assertTrue(numpy.array_equal(data['n(H2)'], expected[0]))
+            self.assertTrue(numpy.array_equal(data['AV'], expected[1]))
+            f = open(filename+'.'+cfg.jsonFileExtension)
+            metadata = json.load(f)
+            f.close()
+            self.assertTrue(metadata['columns'][0]['unit'] == 'cm-3')
+            
+    def test_getFieldNames(self):
+        w = hdf.NumpyWriter('output.npy')
+        for name in ['a', 'b', 'a']:
+            w.addPointer(hdf.PointerFactory().withName(name).withDataset('d'+name).getPointer())
+        self.assertTrue(w.getFieldNames() == ['da#a', 'b', 'da#a#2'])
+        pointer = hdf.PointerFactory().withName('a').withDataset('d').getPointer()
+        self.assertTrue(hdf.Exporter.getFieldNames([pointer]*3) == ['d#a', 'd#a#2', 'd#a#3'])
+        filename = os.path.join(self.directory, 'repeated.npy')
+        hdf.Exporter.exportAsNumpy(self.hdf, None, ['Positions#AV']*3, filename)
+        data = numpy.load(filename)
+        self.assertTrue(data.dtype.names == ('Positions#AV', 'Positions#AV#2', 'Positions#AV#3'))
+        
+class TestHdfWriter(WriterTestCase):
+    output = 'subset.hdf5'
+    
+    def test_export(self):
+        columns = ['Abundances#n(H2)', 'Positions#AV', 'Positions#tau_V']
+        rows = slice(2, 200)
+        hdf.Exporter.exportAsHdf(self.hdf, columns, self.filename, rows, None, 'gzip', True)
+        subset = hdf.PdrHDF(self.filename, False)
+        self.assertTrue(sorted(subset.index.keys()) == ['Abundances', 'Positions'])
+        self.assertTrue(len(subset.index['Positions']) == 2)
+        for column in columns:
+            parts = column.split(cfg.internalSeparator)
+            pointer = subset.index[parts[0]][parts[1]]
+            self.assertTrue(pointer.unit == self.hdf.index[parts[0]][parts[1]].unit)
+            expected = self.hdf.extractQuantity(self.hdf.index[parts[0]][parts[1]], rows)
+            self.assertTrue(numpy.array_equal(subset.extractQuantity(pointer), expected))
+        ds = subset.f[subset.index['Abundances']['n(H2)'].path+'/Abundances']
+        self.assertTrue(ds.compression == 'gzip')
+        self.assertTrue(ds.shape == (198, 1))
+        subset.close()
+        
+class TestStreamWriter(WriterTestCase):
+    def test_noData(self):
+        writers = [hdf.VotableWriter(self.filename), hdf.FitsWriter(self.filename),
+                   hdf.NumpyWriter(self.filename), hdf.HdfWriter(self.filename)]
+        for w in writers:
+            self.assertRaises(Exception, w.stream, self.hdf)
+            self.assertFalse(os.path.exists(self.filename))
+        
+    def test_checkedBeforeOpening(self):
+        source = os.path.join(self.directory, 'mismatch.hdf5')
+        createFile(source, {'Short':numpy.zeros((10, 2)), 'Long':numpy.ones((15, 2))})
+        data = hdf.PdrHDF(source, False)
+        writers = [hdf.Writer(self.filename), hdf.VotableWriter(self.filename), hdf.FitsWriter(self.filename),
+                   hdf.NumpyWriter(self.filename), hdf.HdfWriter(self.filename)]
+        for w in writers:
+            w.addPointer(data.index['Short']['c0'])
+            w.addPointer(data.index['Long']['c1'])
+            try:
+                w.stream(data)
+            except Exception:
+                pass
+            self.assertFalse(os.path.exists(self.filename))
+        w = hdf.Writer(self.filename)
+        w.addPointer(self.hdf.index['Positions']['AV'], '%d %d')
+        w.stream(self.hdf)
+        self.assertFalse(os.path.exists(self.filename))
+        data.close()
+        
+class TestArrowWriter(WriterTestCase):
+    def setUp(self):
+        if hdf.pyarrow is None:
+            self.skipTest('pyarrow is not installed')
+        WriterTestCase.setUp(self)
+        
+    def test_export(self):
+        columns = ['Abundances#n(H2)', 'Positions#AV']
+        expected = self.hdf.extractQuantities(hdf.Exporter.getPointers(self.hdf, columns))
+        filename = os.path.join(self.directory, 'output.parquet')
+        hdf.Exporter.exportAsParquet(self.hdf, None, columns, filename)
+        table = hdf.pyarrow.parquet.read_table(filename)
+        filename = os.path.join(self.directory, 'output.feather')
+        hdf.Exporter.exportAsFeather(self.hdf, None, columns, filename)
+        reader = hdf.pyarrow.RecordBatchFileReader(hdf.pyarrow.OSFile(filename))
+        for table in [table, reader.read_all()]:
+            self.assertTrue(table.schema.names == ['n(H2)', 'AV'])
+            self.assertTrue(table.schema[0].metadata['unit'] == 'cm-3')
+            self.assertTrue(numpy.array_equal(numpy.array(table.column(0).to_pylist()), expected[0]))
+            self.assertTrue(numpy.array_equal(numpy.array(table.column(1).to_pylist()), expected[1]))
+        
+def createFile(filename, datasets):
+    """
+        write a small pdr file with contiguous datasets,
+        datasets[name] = 2d array whose columns are named c0, c1...
+    """
+    f = h5py.File(filename, 'w')
+    rows = []
+    for name, values in datasets.items():
+        f.create_dataset('/Grid/'+name+'/'+name, data=values)
+        for i in range(0, values.shape[1]):
+            rows.append(['/Grid/'+name, name, str(i), 'p'+str(i), 'c'+str(i), 'double', 'u', 's', 'ucd', 'ut', 'd', 'o', 'g'])
+    f.create_dataset('/Metadata/MetaData', data=numpy.array(rows, dtype='S128'))
+    f.close()
+    
+class TestPdrHDF(TemporaryTestCase):
     def setUp(self):
+        TemporaryTestCase.setUp(self)
         self.hdf = hdf.PdrHDF('test_file.hdf5')
         
+    def tearDown(self):
+        self.hdf.close()
+        TemporaryTestCase.tearDown(self)
+        
     def test_defaultcolumn(self):
         result = self.hdf.getDefaultColumns()
         self.assertTrue(len(result) == 3)
@@ -112,12 +575,345 @@ class TestPdrHDF(unittest.TestCase):
         self.assertTrue(pointer.objParent == 'Gas')  
         self.assertTrue(pointer.group == 'MeshCell')  
         
+    def test_compactIndex(self):
+        self.assertTrue(isinstance(self.hdf.index, hdf.MetadataIndex))
+        self.assertTrue('Abundances' in self.hdf.index)
+        self.assertTrue('n(H2)' in self.hdf.index['Abundances'])
+        self.assertTrue(len(self.hdf.index['Positions']) == 3)
+        pointer = self.hdf.index['Abundances']['n(H2)']
+        self.assertFalse(hasattr(pointer, '__dict__'))
+        row = self.hdf.index.getRow('Abundances', 'n(H2)')
+        self.assertTrue(self.hdf.metadata[row][4] == 'n(H2)')
+        
+    def test_lazyIndex(self):
+        lazy = hdf.PdrHDF('test_file.hdf5', False, True)
+        self.assertTrue(sorted(lazy.index.keys()) == sorted(self.hdf.index.keys()))
+        self.assertFalse(lazy.index.isLoaded('Abundances'))
+        self.assertTrue(len(lazy.getDefaultColumns()) == 3)
+        self.assertFalse(lazy.index.isLoaded('Abundances'))
+        pointer = lazy.index['Abundances']['n(H2)']
+        self.assertTrue(lazy.index.isLoaded('Abundances'))
+        self.assertTrue(pointer.column == '1')
+        self.assertTrue(pointer.unit == 'cm-3')
+        self.assertTrue(sorted(lazy.index['Abundances'].keys()) == sorted(self.hdf.index['Abundances'].keys()))
+        
+    def test_memoryMap(self):
+        unmapped = hdf.PdrHDF('test_file.hdf5', memorymap=False)
+        for dataset in ['Positions', 'Abundances']:
+            for name in self.hdf.index[dataset].keys()[0:3]:
+                pointer = self.hdf.index[dataset][name]
+                data = self.hdf.extractQuantity(pointer)
+                self.assertFalse(unmapped.isMapped(pointer))
+                self.assertTrue(numpy.array_equal(data, unmapped.extractQuantity(pointer)))
+                if self.hdf.isMapped(pointer):
+                    self.assertFalse(data.flags['OWNDATA'])
+        
+    def test_memoryMapContiguous(self):
+        filename = os.path.join(self.directory, 'mapped.hdf5')
+        values = numpy.arange(60.0).reshape(20, 3)
+        createFile(filename, {'Little':values, 'Big':values.astype('>f8')})
+        data = hdf.PdrHDF(filename, False)
+        reference = h5py.File(filename, 'r')
+        for dataset in ['Little', 'Big']:
+            pointer = data.index[dataset]['c1']
+            self.assertTrue(data.isMapped(pointer))
+            column = data.extractQuantity(pointer)
+            self.assertFalse(column.flags['OWNDATA'])
+            self.assertTrue(numpy.array_equal(column, reference['/Grid/'+dataset+'/'+dataset][:, 1]))
+            self.assertTrue(numpy.array_equal(column, values[:, 1]))
+        reference.close()
+        data.close()
+        
+    def test_extractRows(self):
+        rows = slice(10, 300, 7)
+        unmapped = hdf.PdrHDF('test_file.hdf5', memorymap=False)
+        for pointer in [self.hdf.index['Abundances']['n(H2)'], self.hdf.index['Positions']['AV']]:
+            full = unmapped.extractQuantity(pointer)
+            self.assertTrue(numpy.array_equal(self.hdf.extractQuantity(pointer, rows), full[rows]))
+            self.assertTrue(numpy.array_equal(unmapped.extractQuantity(pointer, rows), full[rows]))
+            self.assertTrue(numpy.array_equal(unmapped.extractQuantities([pointer], rows)[0], full[rows]))
+            self.assertTrue(len(unmapped.extractQuantity(pointer, slice(None, 5))) == 5)
+        
+    def test_selectRows(self):
+        unmapped = hdf.PdrHDF('test_file.hdf5', memorymap=False)
+        av = unmapped.extractQuantity(self.hdf.index['Positions']['AV'])
+        h2 = unmapped.extractQuantity(self.hdf.index['Abundances']['n(H2)'])
+        filters = [('Positions#AV', '<', 5.0), ('Abundances#n(H2)', '>=', 0.2)]
+        expected = numpy.flatnonzero((av < 5.0) & (h2 >= 0.2))
+        self.assertTrue(numpy.array_equal(self.hdf.selectRows(filters), expected))
+        expected = numpy.flatnonzero(av[1::3] < 5.0)*3+1
+        self.assertTrue(numpy.array_equal(self.hdf.selectRows(filters[0:1], slice(1, None, 3)), expected))
+        
+    def test_extractCoordinates(self):
+        rows = numpy.array([0, 3, 4, 150, 151, 400])
+        unmapped = hdf.PdrHDF('test_file.hdf5', memorymap=False)
+        pointers = [self.hdf.index['Abundances']['n(H2)'], self.hdf.index['Positions']['AV'], self.hdf.index['Positions']['tau_V']]
+        for pointer in pointers:
+            full = unmapped.extractQuantity(pointer)
+            self.assertTrue(numpy.array_equal(self.hdf.extractQuantity(pointer, rows), full[rows]))
+            self.assertTrue(numpy.array_equal(unmapped.extractQuantity(pointer, rows), full[rows]))
+        data = unmapped.extractQuantities(pointers, rows)
+        for i in range(0, len(pointers)):
+            self.assertTrue(numpy.array_equal(data[i], unmapped.extractQuantity(pointers[i])[rows]))
+        
+    def test_iterColumns(self):
+        pointers = [self.hdf.index['Abundances']['n(H2)'], self.hdf.index['Positions']['AV']]
+        for rows in [None, slice(7, 390, 4), numpy.array([1, 2, 60, 61, 299, 412])]:
+            expected = self.hdf.extractQuantities(pointers, rows)
+            blocks = list(self.hdf.iterColumns(pointers, 50, rows))
+            for block in blocks:
+                self.assertTrue(len(block) == 2)
+                self.assertTrue(len(block[0]) <= 50)
+            for i in range(0, 2):
+                self.assertTrue(numpy.array_equal(numpy.concatenate([block[i] for block in blocks]), expected[i]))
+            self.assertTrue(self.hdf.getRowCount(pointers, rows) == len(expected[0]))
+        
+    def test_sizeMismatch(self):
+        filename = os.path.join(self.directory, 'mismatch.hdf5')
+        createFile(filename, {'Short':numpy.zeros((10, 2)), 'Long':numpy.ones((15, 2))})
+        data = hdf.PdrHDF(filename, False)
+        pointers = [data.index['Short']['c0'], data.index['Long']['c1']]
+        for streamed in [pointers, pointers[::-1]]:
+            self.assertRaises(Exception, list, data.iterColumns(streamed))
+            self.assertRaises(Exception, data.getRowCount, streamed)
+        data.close()
+        
+    def test_streamCache(self):
+        data = hdf.PdrHDF('test_file.hdf5', memorymap=False)
+        pointers = [data.index['Abundances']['n(H2)'], data.index['Positions']['AV']]
+        rows = slice(3, 300, 2)
+        expected = data.extractQuantities(pointers, rows)
+        data.clearCache()
+        #block reads do not fill the cache
+        blocks = list(data.iterColumns(pointers, 50, rows))
+        for i in range(0, 2):
+            self.assertTrue(numpy.array_equal(numpy.concatenate([block[i] for block in blocks]), expected[i]))
+        self.assertTrue(data.cache.used == 0)
+        #blocks are sliced from complete columns already cached
+        cached = data.extractQuantity(pointers[0])
+        for block in data.iterColumns(pointers, 50, rows):
+            self.assertTrue(numpy.shares_memory(block[0], cached))
+            self.assertFalse(numpy.shares_memory(block[1], cached))
+        data.close()
+        
+    def test_getBlockRows(self):
+        pointer = self.hdf.index['Abundances']['n(H2)']
+        chunks = self.hdf.f[pointer.path+'/'+pointer.dataset].chunks
+        blockRows = self.hdf.getBlockRows([pointer])
+        if chunks is not None:
+            self.assertTrue(blockRows % chunks[0] == 0 or blockRows == chunks[0])
+        else:
+            self.assertTrue(blockRows == cfg.blockRows)
+        
     def test_extractQuantity(self):
         pointer = self.hdf.index['Abundances']['n(H2)'] 
         data = self.hdf.extractQuantity(pointer)
         self.assertTrue(len(data) == 413)
         self.assertTrue(data[0] == 0.6252262921840082)
         
+    def test_extractQuantityArray(self):
+        pointer = self.hdf.index['Abundances']['n(H2)'] 
+        data = hdf.PdrHDF('test_file.hdf5', memorymap=False).extractQuantity(pointer)
+        self.assertTrue(isinstance(data, numpy.ndarray))
+        self.assertTrue(data.flags['C_CONTIGUOUS'])
+        pointer = self.hdf.index['Positions']['AV'] 
+        self.assertTrue(isinstance(self.hdf.extractQuantity(pointer), numpy.ndarray))
+        
+class TestExtractionPlanner(unittest.TestCase):
+    def setUp(self):
+        self.hdf = hdf.PdrHDF('test_file.hdf5')
+        
+    def test_getGroups(self):
+        index = self.hdf.index
+        pointers = [index['Positions']['AV'], index['Abundances']['n(H2)'], index['Positions']['tau_V']]
+        groups = hdf.ExtractionPlanner(pointers).getGroups()
+        self.assertTrue(len(groups) == 2)
+        self.assertTrue(groups[0] == ((pointers[0].path, 'Positions'), [0, 2]))
+        self.assertTrue(groups[1] == (('/CloudStructure/Abundances', 'Abundances'), [1]))
+        
+    def test_extractQuantities(self):
+        index = self.hdf.index
+        pointers = [index['Positions']['AV'], index['Abundances']['n(H2)'], index['Positions']['tau_V']]
+        data = self.hdf.extractQuantities(pointers)
+        self.assertTrue(len(data) == 3)
+        for i in range(0, 3):
+            self.assertTrue(numpy.array_equal(data[i], self.hdf.extractQuantity(pointers[i])))
+        
+class TestIndexCache(TemporaryTestCase):
+    def setUp(self):
+        TemporaryTestCase.setUp(self)
+        self.filename = os.path.join(self.directory, 'test_file.hdf5')
+        shutil.copy('test_file.hdf5', self.filename)
+        
+    def test_sidecar(self):
+        reference = hdf.PdrHDF(self.filename, False)
+        cache = hdf.IndexCache(self.filename, self.directory)
+        self.assertFalse(os.path.exists(cache.filename))
+        directory = cfg.indexCacheDirectory
+        cfg.indexCacheDirectory = self.directory
+        try:
+            hdf.PdrHDF(self.filename, True)
+            self.assertTrue(os.path.exists(cache.filename))
+            cached = hdf.PdrHDF(self.filename, True)
+        finally:
+            cfg.indexCacheDirectory = directory
+        self.assertFalse(os.path.exists(self.filename+'.'+cfg.indexCacheExtension))
+        self.assertTrue(sorted(cached.index.keys()) == sorted(reference.index.keys()))
+        pointer = cached.index['Abundances']['n(H2)']
+        self.assertTrue(pointer.column == '1')
+        self.assertTrue(pointer.unit == 'cm-3')
+        self.assertTrue(numpy.array_equal(cached.extractQuantity(pointer), reference.extractQuantity(pointer)))
+        
+    def test_invalidation(self):
+        data = hdf.PdrHDF(self.filename, False)
+        index = data.index
+        shape = data.metadata.shape
+        cache = hdf.IndexCache(self.filename, self.directory)
+        cache.save(shape, index)
+        loaded = hdf.IndexCache(self.filename, self.directory).load(shape)
+        self.assertTrue(loaded.datasets == index.datasets)
+        self.assertTrue(loaded.strings == index.strings)
+        self.assertTrue(hdf.IndexCache(self.filename, self.directory).load((0, 13)) is None)
+        os.utime(self.filename, (0, 0))
+        self.assertTrue(hdf.IndexCache(self.filename, self.directory).load(shape) is None)
+        
+    def test_noPickle(self):
+        f = open(hdf.IndexCache(self.filename, self.directory).filename, 'wb')
+        numpy.save(f, numpy.array([{'a':1}], dtype=object))
+        f.close()
+        self.assertTrue(hdf.IndexCache(self.filename, self.directory).load((0, 13)) is None)
+        
+class TestColumnCache(unittest.TestCase):
+    def test_lru(self):
+        cache = hdf.ColumnCache(32)
+        cache.put('a', numpy.zeros(2))
+        cache.put('b', numpy.zeros(2))
+        self.assertTrue(cache.get('a') is not None)
+        cache.put('c', numpy.zeros(2))
+        self.assertTrue(cache.used == 32)
+        self.assertTrue(cache.get('b') is None)
+        self.assertTrue(cache.get('a') is not None)
+        self.assertTrue(cache.hits == 2)
+        self.assertTrue(cache.misses == 1)
+        cache.put('d', numpy.zeros(8))
+        self.assertTrue(cache.get('d') is None)
+        cache.clear()
+        self.assertTrue(cache.used == 0)
+        self.assertTrue(cache.get('a') is None)
+        
+    def test_extraction(self):
+        #mapped columns are not cached
+        data = hdf.PdrHDF('test_file.hdf5', memorymap=False)
+        pointer = data.index['Abundances']['n(H2)']
+        first = data.extractQuantity(pointer)
+        self.assertTrue(data.extractQuantity(pointer) is first)
+        self.assertTrue(data.extractQuantities([pointer])[0] is first)
+        self.assertTrue(data.cache.hits == 2)
+        data.clearCache()
+        self.assertFalse(data.extractQuantity(pointer) is first)
+        data.close()
+        
+    def test_readOnly(self):
+        column = numpy.zeros(2)
+        hdf.ColumnCache(32).put('a', column)
+        self.assertTrue(column.flags.writeable)
+        for memorymap in [True, False]:
+            for cachesize in [0, 8, 1 << 20]:
+                data = hdf.PdrHDF('test_file.hdf5', memorymap=memorymap, cachesize=cachesize)
+                pointers = [data.index['Abundances']['n(H2)'], data.index['Positions']['AV']]
+                for rows in [None, slice(5, 50), numpy.array([1, 7, 300])]:
+                    columns = data.extractQuantities(pointers, rows)
+                    columns += [data.extractQuantity(pointer, rows) for pointer in pointers]
+                    for block in data.iterColumns(pointers, 50, rows):
+                        columns += block
+                    for column in columns:
+                        self.assertFalse(column.flags.writeable)
+                data.close()
+        
+class TestScriptReader(TemporaryTestCase):
+    def setUp(self):
+        TemporaryTestCase.setUp(self)
+        self.filename = os.path.join(self.directory, 'script.esf')
+        f = open(self.filename, 'w')
+        f.write("#precision:double\n#rows:1000:5000:2\n#comment\nAbundances#n(H2)\n")
+        f.close()
+        
+    def test_getRows(self):
+        self.assertTrue(util.ScriptReader.getRows(self.filename) == slice(1000, 5000, 2))
+        self.assertTrue(util.ScriptReader.parseRows('::10') == slice(None, None, 10))
+        self.assertTrue(util.ScriptReader.parseRows('100') == slice(100, None, None))
+        self.assertRaises(Exception, util.ScriptReader.parseRows, '1:2:0')
+        self.assertTrue(util.ScriptReader.formatRows(slice(None, 10, 2)) == "#rows::10:2\n")
+        
+    def test_getFilters(self):
+        f = open(self.filename, 'a')
+        f.write("#filter:Positions#AV < 5\n#filter:Abundances#n(H) >= 1e3\n")
+        f.close()
+        filters = util.ScriptReader.getFilters(self.filename)
+        self.assertTrue(filters == [('Positions#AV', '<', 5.0), ('Abundances#n(H)', '>=', 1000.0)])
+        self.assertTrue(util.ScriptReader.getHeader(self.filename)[1] == ["#comment\n"])
+        self.assertRaises(Exception, util.ScriptReader.parseFilter, 'AV < 5')
+        self.assertTrue(util.ScriptReader.formatFilter(filters[0]) == "#filter:Positions#AV < 5.0\n")
+        
+    def test_getHeader(self):
+        precision, header = util.ScriptReader.getHeader(self.filename)
+        self.assertTrue(precision == cfg.doublePrecision)
+        f = open(self.filename, 'w')
+        f.write("#precision:roundtrip\nAbundances#n(H2)\n")
+        f.close()
+        self.assertTrue(util.ScriptReader.getHeader(self.filename)[0] == cfg.roundtripPrecision)
+        self.assertTrue(header == ["#comment\n"])
+        self.assertTrue(util.ScriptReader.getColumns(self.filename) == ['Abundances#n(H2)'])
+        
+class TestBatch(TemporaryTestCase):
+    def setUp(self):
+        TemporaryTestCase.setUp(self)
+        self.options = {'header':None, 'columns':['Abundances#n(H2)', 'Positions#AV'], 'rows':None, 'filters':None,
+                        'precision':cfg.floatPrecision, 'isDouble':False, 'fileformat':cfg.txtFileExtension,
+                        'separator':',', 'indexcache':False, 'lazy':False, 'jobs':1, 'compression':None,
+                        'shuffle':False, 'textcompression':None, 'threads':1, 'serialization':cfg.votableSerialization}
+        
+    def test_getOutputName(self):
+        self.assertTrue(extractor.getOutputName('out/{stem}.txt', 'data/model.hdf5') == 'out/model.txt')
+        self.assertTrue(extractor.getOutputName('{dir}/{name}.txt', 'data/model.hdf5') == 'data/model.hdf5.txt')
+        
+    def test_isTemplate(self):
+        self.assertTrue(extractor.isTemplate('{stem}.txt'))
+        self.assertTrue(extractor.isTemplate('{dir}/out.txt'))
+        self.assertFalse(extractor.isTemplate('out.txt'))
+        self.assertFalse(extractor.isTemplate('{unknown}.txt'))
+        self.assertFalse(extractor.isTemplate('{0}.txt'))
+        
+    def test_runBatch(self):
+        hdffiles = []
+        for name in ['a', 'b']:
+            hdffiles.append(os.path.join(self.directory, name+'.hdf5'))
+            shutil.copy('test_file.hdf5', hdffiles[-1])
+        broken = os.path.join(self.directory, 'broken.hdf5')
+        f = open(broken, 'w')
+        f.write('not a hdf file')
+        f.close()
+        hdffiles.append(broken)
+        template = os.path.join('{dir}', '{stem}.txt')
+        failures = extractor.runBatch(hdffiles, template, self.options)
+        self.assertTrue(failures == [broken])
+        expected = open(extractor.getOutputName(template, hdffiles[0])).read()
+        self.assertTrue(open(extractor.getOutputName(template, hdffiles[1])).read() == expected)
+        
+    def test_failedExport(self):
+        hdffile = os.path.join(self.directory, 'mismatch.hdf5')
+        createFile(hdffile, {'Short':numpy.zeros((10, 2)), 'Long':numpy.ones((15, 2))})
+        outputfile = os.path.join(self.directory, 'mismatch.txt')
+        f = open(outputfile, 'w')
+        f.write('previous export')
+        f.close()
+        self.options['columns'] = ['Short#c0', 'Long#c1']
+        for fileformat in [cfg.txtFileExtension, cfg.votableFileExtension]:
+            self.options['fileformat'] = fileformat
+            #the error is reported and the previous output is kept
+            self.assertTrue(extractor.exportFile((hdffile, outputfile, self.options))[3] is not None)
+            self.assertTrue(open(outputfile).read() == 'previous export')
+        
 class TestFieldFactory(unittest.TestCase):
     def setUp(self):
         builder = vot.FieldBuilder()
@@ -170,10 +966,63 @@ def suite():
     suite.addTest(TestLinkFactory('test_getLink'))
     suite.addTest(TestConversion('test_float'))
     suite.addTest(TestConversion('test_double'))
+    suite.addTest(TestConversion('test_roundtrip'))
+    suite.addTest(TestConversion('test_blockFormatter'))
+    suite.addTest(TestConversion('test_columnFormat'))
+    suite.addTest(TestWriter('test_write'))
+    suite.addTest(TestWriter('test_stream'))
+    suite.addTest(TestWriter('test_parallel'))
+    suite.addTest(TestWriter('test_mixedTypes'))
+    suite.addTest(TestWriter('test_roundtrip'))
+    suite.addTest(TestWriter('test_compressed'))
+    suite.addTest(TestWriter('test_getCompression'))
+    suite.addTest(TestVotableWriter('test_stream'))
+    suite.addTest(TestVotableWriter('test_binary'))
+    suite.addTest(TestVotableWriter('test_nulls'))
+    suite.addTest(TestVotableWriter('test_template'))
+    suite.addTest(TestVotableWriter('test_read'))
+    suite.addTest(TestVotableWriter('test_readCompressed'))
+    suite.addTest(TestVotableWriter('test_readWithoutRowCount'))
+    suite.addTest(TestFitsWriter('test_export'))
+    suite.addTest(TestFitsWriter('test_duplicateNames'))
+    suite.addTest(TestFitsWriter('test_getCard'))
+    suite.addTest(TestNumpyWriter('test_export'))
+    suite.addTest(TestNumpyWriter('test_getFieldNames'))
+    suite.addTest(TestHdfWriter('test_export'))
+    suite.addTest(TestStreamWriter('test_noData'))
+    suite.addTest(TestStreamWriter('test_checkedBeforeOpening'))
+    suite.addTest(TestArrowWriter('test_export'))
     suite.addTest(TestPdrHDF('test_defaultcolumn'))
     suite.addTest(TestPdrHDF('test_getByGroup'))
     suite.addTest(TestPdrHDF('test_index'))
+    suite.addTest(TestPdrHDF('test_compactIndex'))
+    suite.addTest(TestPdrHDF('test_lazyIndex'))
     suite.addTest(TestPdrHDF('test_extractQuantity'))
+    suite.addTest(TestPdrHDF('test_extractQuantityArray'))
+    suite.addTest(TestPdrHDF('test_memoryMap'))
+    suite.addTest(TestPdrHDF('test_memoryMapContiguous'))
+    suite.addTest(TestPdrHDF('test_extractRows'))
+    suite.addTest(TestPdrHDF('test_selectRows'))
+    suite.addTest(TestPdrHDF('test_extractCoordinates'))
+    suite.addTest(TestPdrHDF('test_iterColumns'))
+    suite.addTest(TestPdrHDF('test_streamCache'))
+    suite.addTest(TestPdrHDF('test_sizeMismatch'))
+    suite.addTest(TestPdrHDF('test_getBlockRows'))
+    suite.addTest(TestExtractionPlanner('test_getGroups'))
+    suite.addTest(TestExtractionPlanner('test_extractQuantities'))
+    suite.addTest(TestIndexCache('test_sidecar'))
+    suite.addTest(TestIndexCache('test_invalidation'))
+    suite.addTest(TestIndexCache('test_noPickle'))
+    suite.addTest(TestColumnCache('test_lru'))
+    suite.addTest(TestColumnCache('test_extraction'))
+    suite.addTest(TestColumnCache('test_readOnly'))
+    suite.addTest(TestScriptReader('test_getRows'))
+    suite.addTest(TestScriptReader('test_getHeader'))
+    suite.addTest(TestScriptReader('test_getFilters'))
+    suite.addTest(TestBatch('test_getOutputName'))
+    suite.addTest(TestBatch('test_isTemplate'))
+    suite.addTest(TestBatch('test_runBatch'))
+    suite.addTest(TestBatch('test_failedExport'))
     suite.addTest(TestFieldFactory('test_getField'))
     suite.addTest(TestField('test_getField'))
     suite.addTest(TestField('test_toString'))
@@ -1,6 +1,10 @@
 import config as cfg
+import re
 
 class ScriptReader(object):
+    #dataset#name operator value
+    filterExpression = re.compile(r'^(.+?)\s*(<=|>=|==|!=|<|>)\s*(\S+)$')
+    
     @staticmethod
     def getColumns(filename):
         f = open(filename)
@@ -20,11 +24,83 @@ class ScriptReader(object):
             if value[0] == '#':
                 if '#precision:' in value:
                         tmp =  value.split(':')[1].strip()
-                        if tmp == cfg.doublePrecision :
+                        if tmp in (cfg.doublePrecision, cfg.roundtripPrecision) :
                             precision = tmp
+                elif value.startswith(cfg.rowsDirective) or value.startswith(cfg.filterDirective):
+                    pass
                 else:
                     result.append(value)
         f.close()
         if len(result) == 0:
             return precision, None
         return precision, result  
+        
+    @staticmethod
+    def getRows(filename):
+        """
+            returns the rows selected by a #rows:start:stop:step line 
+            as a slice, None if all the rows are exported
+        """
+        f = open(filename)
+        result = None
+        for value in f.readlines():
+            if value.startswith(cfg.rowsDirective):
+                result = ScriptReader.parseRows(value[len(cfg.rowsDirective):])
+        f.close()
+        return result
+        
+    @staticmethod
+    def parseRows(value):
+        """
+            converts a start:stop:step string into a slice, 
+            empty values are allowed
+        """
+        parts = value.strip().split(':')
+        if len(parts) > 3:
+            raise Exception("invalid rows selection : "+value.strip())
+        bounds = [None, None, None]
+        for i in range(0, len(parts)):
+            if parts[i].strip() != '':
+                bounds[i] = int(parts[i])
+        if bounds[2] is not None and bounds[2] < 1:
+            raise Exception("row step must be positive")
+        return slice(bounds[0], bounds[1], bounds[2])
+        
+    @staticmethod
+    def formatRows(rows):
+        """
+            converts a slice into a #rows: line
+        """
+        bounds = [rows.start, rows.stop, rows.step]
+        return cfg.rowsDirective+':'.join(['' if value is None else str(value) for value in bounds])+"\n"
+        
+    @staticmethod
+    def getFilters(filename):
+        """
+            returns the row filters given by #filter: lines 
+            as a list of (dataset#name, operator, value) tuples
+        """
+        f = open(filename)
+        result = []
+        for value in f.readlines():
+            if value.startswith(cfg.filterDirective):
+                result.append(ScriptReader.parseFilter(value[len(cfg.filterDirective):]))
+        f.close()
+        return result
+        
+    @staticmethod
+    def parseFilter(value):
+        """
+            converts a 'dataset#name operator value' string into a tuple
+        """
+        match = ScriptReader.filterExpression.match(value.strip())
+        if match is None or cfg.internalSeparator not in match.group(1):
+            raise Exception("invalid filter : "+value.strip())
+        return (match.group(1), match.group(2), float(match.group(3)))
+        
+    @staticmethod
+    def formatFilter(rowfilter):
+        """
+            converts a filter tuple into a #filter: line
+        """
+        return cfg.filterDirective+rowfilter[0]+' '+rowfilter[1]+' '+repr(rowfilter[2])+"\n"
@@ -1,4 +1,11 @@
+import base64
+import collections
+import cStringIO
+import xml.parsers.expat
+import numpy
 import convert as conv
+import compression as comp
+import config as cfg
 
 class FieldBuilder(object):
     def __init__(self):
@@ -133,6 +140,12 @@ class Link(object):
             result += ' action="'+self.action+'"'
         
         return result+'/>'
+        
+    def getKey(self):
+        """
+            returns a tuple of the attributes of the link
+        """
+        return (self.id, self.contentRole, self.contentType, self.title, self.value, self.href, self.action)
 
 class Field(object):
     def __init__(self):
@@ -197,11 +210,65 @@ class Field(object):
             result += "\n"+self.link.toString()            
            
         return result+"\n</FIELD>"
+        
+    def getKey(self):
+        """
+            returns a tuple of the attributes of the field
+        """
+        link = None
+        if self.link is not None:
+            link = self.link.getKey()
+        return (self.name, self.ucd, self.utype, self.unit, self.id, self.datatype, self.arraysize,
+                self.width, self.precision, self.xtype, self.ref, self.description, link)
+
+class TemplateCache(object):
+    """
+        least recently used cache of the headers and row formatters
+        compiled for sets of fields
+    """
+    def __init__(self, size):
+        #maximum number of templates, 0 disables the cache
+        self.size = size
+        #templates[key] = (header, formatter), oldest first
+        self.templates = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        
+    def get(self, key):
+        """
+            returns the cached template or None
+        """
+        template = self.templates.pop(key, None)
+        if template is None:
+            self.misses += 1
+            return None
+        #move the template at the end of the queue
+        self.templates[key] = template
+        self.hits += 1
+        return template
+        
+    def put(self, key, template):
+        """
+            add a template, removing the least recently used ones if needed
+        """
+        self.templates[key] = template
+        while len(self.templates) > self.size:
+            self.templates.popitem(False)
+            
+    def clear(self):
+        self.templates.clear()
+        
+#templates of the tables written by this process
+templates = TemplateCache(cfg.templateCacheSize)
 
 class Votable(object):
     def __init__(self):
         self.fields = []
         self.columns = []
+        #roundtrip to write double values with as few digits as possible
+        self.precision = None
+        #TABLEDATA, BINARY or BINARY2
+        self.serialization = cfg.tabledataSerialization
         
     def addField(self, field):
         if isinstance(field, Field):
@@ -211,45 +278,472 @@ class Votable(object):
         self.columns.append(data)
         
         
-    def getTable(self):
+    def getKey(self):
+        """
+            returns the key of the template of the table in the cache
+        """
+        return (self.serialization, self.precision, tuple([field.getKey() for field in self.fields]))
+        
+    def getTemplate(self):
+        """
+            returns the xml before and after the <TABLE> element and the <TR> 
+            row formatter compiled for the fields, shared with the previous 
+            tables having the same fields
+        """
+        key = self.getKey()
+        template = templates.get(key)
+        if template is None:
+            template = (self.__compilePrologue(), self.__compileHeader(), self.__compileFormatter())
+            templates.put(key, template)
+        return template
+        
+    def getHeader(self, rows=None):
+        """
+            returns the beginning of the document, up to the first row
+            rows : number of rows written in the nrows attribute of the table, if not None
+        """
+        template = self.getTemplate()
+        table = '<TABLE name="results"'
+        if rows is not None:
+            table += ' nrows="'+str(rows)+'"'
+        return template[0]+table+'>'+"\n"+template[1]
+        
+    def __compilePrologue(self):
+        """
+            returns the xml of the document before the <TABLE> element
+        """
+        #BINARY2 appeared in version 1.3
+        version = '1.2'
+        if self.serialization == cfg.binary2Serialization:
+            version = '1.3'
         result = '<?xml version="1.0"?>'
-        result += '<VOTABLE version="1.2" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xmlns="http://www.ivoa.net/xml/VOTable/v1.2">'+"\n"
+        result += '<VOTABLE version="'+version+'" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xmlns="http://www.ivoa.net/xml/VOTable/v'+version+'">'+"\n"
         result += '<RESOURCE name="PdrExporter">'+"\n"
-        result += '<TABLE name="results">'+"\n"
+        return result
         
+    def __compileHeader(self):
+        """
+            returns the xml of the document after the <TABLE> element, up to the first row
+        """
+        result = ''
         for field in self.fields : 
             result += field.toString()+"\n"
             
         result += '<DATA>'+"\n"
-        result += '<TABLEDATA>'+"\n"         
-         
-        columns_size = len(self.columns)
-        data_size = len(self.columns[0])
-        for i in range(0, data_size):        
-            result += '<TR>'+"\n"            
-            for j in range(0, columns_size):
-                result += '<TD>'+str(conv.getValue(self.columns[j][i], self.fields[j].datatype))+'</TD>'+"\n"
-            result += '</TR>'+"\n"
-            
-        result += '</TABLEDATA>'+"\n"
+        if self.serialization == cfg.tabledataSerialization:
+            result += '<TABLEDATA>'+"\n"
+        else:
+            result += '<'+self.serialization+'>'+"\n"
+            result += '<STREAM encoding="base64">'+"\n"
+        return result
+        
+    def getFooter(self):
+        """
+            returns the end of the document, after the last row
+        """
+        if self.serialization == cfg.tabledataSerialization:
+            result = '</TABLEDATA>'+"\n"
+        else:
+            result = '</STREAM>'+"\n"
+            result += '</'+self.serialization+'>'+"\n"
         result += '</DATA>'+"\n"
         
         result += '</TABLE>'+"\n"
         result += '</RESOURCE>'+"\n"
         
         result += '</VOTABLE>'
-        return result        
+        return result
+        
+    def getFormatter(self):
+        """
+            returns the formatter of the <TR> rows, compiled from the 
+            datatypes of the fields, or the encoder of the binary stream
+        """
+        if self.serialization == cfg.binarySerialization:
+            return BinaryEncoder(self.fields)
+        if self.serialization == cfg.binary2Serialization:
+            return BinaryEncoder(self.fields, True)
+        return self.getTemplate()[2]
+        
+    def __compileFormatter(self):
+        """
+            returns the formatter of the <TR> rows, None for binary tables
+        """
+        if self.serialization != cfg.tabledataSerialization:
+            return None
+        formats = []
+        for field in self.fields:
+            vtype = field.datatype
+            if self.precision is not None and vtype == 'double':
+                vtype = self.precision
+            formats.append(conv.getFormat(vtype))
+        return conv.BlockFormatter(formats, '</TD>'+"\n"+'<TD>', '<TR>'+"\n"+'<TD>', '</TD>'+"\n"+'</TR>'+"\n")
+        
+    def iterRows(self, columns, formatter=None):
+        """
+            generator of the text of the rows of columns, 
+            by blocks of cfg.formatRows rows
+        """
+        if formatter is None:
+            formatter = self.getFormatter()
+        if len(columns) == 0:
+            return
+        for first in xrange(0, len(columns[0]), cfg.formatRows):
+            last = first+cfg.formatRows
+            yield formatter.format([column[first:last] for column in columns])
+            
+    def write(self, f, blocks, rows=None):
+        """
+            write the document in the open file f,
+            blocks is an iterable of lists of columns written one after the other
+            rows : total number of rows of the blocks, written in the table if not None
+        """
+        formatter = self.getFormatter()
+        f.write(self.getHeader(rows))
+        for columns in blocks:
+            for text in self.iterRows(columns, formatter):
+                f.write(text)
+        if isinstance(formatter, BinaryEncoder):
+            f.write(formatter.flush())
+        f.write(self.getFooter())
+        
+    def getRowCount(self):
+        """
+            returns the number of rows of the columns
+        """
+        if len(self.columns) == 0:
+            return 0
+        return len(self.columns[0])
         
-    '''def __getValue(self, value, vtype):
-        if vtype == "double":
-            return "%.15e"%value
-        elif vtype == "float":
-            return "%.6e"%value
-        else:
-            return value
-    '''
+    def getTable(self):
+        f = cStringIO.StringIO()
+        self.write(f, [self.columns], self.getRowCount())
+        return f.getvalue()
+        
+    def toFile(self, filename, compression=None, threads=1):        
+        """
+            write the table in filename
+            compression : gzip, bz2, xz, zstd or none, guessed from the file extension if None
+            threads : number of threads compressing the output
+        """
+        f = comp.openOutput(filename, compression, threads)
+        try:
+            self.write(f, [self.columns], self.getRowCount())
+        finally:
+            f.close()
+
+
+class BinaryEncoder(object):
+    """
+        encodes blocks of rows into the base64 stream of a BINARY 
+        or BINARY2 table, values are packed in big endian order
+    """
+    #numpy types of the votable datatypes
+    dtypes = {'unsignedByte':'u1', 'short':'>i2', 'int':'>i4', 'long':'>i8', 'float':'>f4', 'double':'>f8'}
+    
+    def __init__(self, fields, binary2=False):
+        #BINARY2 rows begin with a null flag per field
+        self.binary2 = binary2
+        #number of bytes of the null flags of a row
+        self.nullBytes = (len(fields)+7)//8
+        types = []
+        if binary2:
+            types.append(('nulls', 'u1', (self.nullBytes,)))
+        for i in range(0, len(fields)):
+            types.append(('f'+str(i), BinaryEncoder.getDtype(fields[i])))
+        #packed type of a row
+        self.dtype = numpy.dtype(types)
+        #bytes not encoded yet, base64 encodes groups of 3 bytes
+        self.pending = ''
+        
+    @staticmethod
+    def getDtype(field):
+        """
+            returns the big endian numpy type of the values of field
+        """
+        if field.datatype == 'char' and field.arraysize is not None and field.arraysize.isdigit():
+            return 'S'+field.arraysize
+        if field.datatype not in BinaryEncoder.dtypes:
+            raise Exception("datatype "+str(field.datatype)+" can not be written in binary")
+        return BinaryEncoder.dtypes[field.datatype]
+        
+    def format(self, columns):
+        """
+            returns the base64 text of the rows of columns
+        """
+        size = 0
+        if len(columns) > 0:
+            size = len(columns[0])
+        rows = numpy.empty(size, dtype=self.dtype)
+        for i in range(0, len(columns)):
+            rows['f'+str(i)] = columns[i]
+        if self.binary2:
+            #NaN values are flagged as null, first field in the highest bit
+            nulls = numpy.zeros((size, self.nullBytes*8), dtype=bool)
+            for i in range(0, len(columns)):
+                if rows.dtype['f'+str(i)].kind == 'f':
+                    nulls[:, i] = numpy.isnan(rows['f'+str(i)])
+            rows['nulls'] = numpy.packbits(nulls, axis=1)
+        data = self.pending+rows.tostring()
+        end = len(data)-len(data)%3
+        self.pending = data[end:]
+        if end == 0:
+            return ''
+        return base64.b64encode(data[:end])+"\n"
+        
+    def flush(self):
+        """
+            returns the base64 text of the last bytes
+        """
+        data = self.pending
+        self.pending = ''
+        if len(data) == 0:
+            return ''
+        return base64.b64encode(data)+"\n"
+
+
+class BinaryDecoder(object):
+    """
+        decodes the base64 stream of a BINARY or BINARY2 table into 
+        blocks of rows, the text may be cut anywhere
+    """
+    def __init__(self, fields, binary2=False):
+        #BINARY2 rows begin with a null flag per field
+        self.binary2 = binary2
+        #packed type of a row, the same as the one of the encoder
+        self.dtype = BinaryEncoder(fields, binary2).dtype
+        #base64 characters not decoded yet, decoded by groups of 4
+        self.text = ''
+        #bytes of an incomplete row
+        self.pending = ''
+        
+    def decode(self, text):
+        """
+            returns the records of the complete rows of the text
+        """
+        text = self.text+''.join(text.split())
+        end = len(text)-len(text)%4
+        self.text = text[end:]
+        data = self.pending+base64.b64decode(text[0:end])
+        end = len(data)-len(data)%self.dtype.itemsize
+        self.pending = data[end:]
+        return numpy.frombuffer(data[0:end], dtype=self.dtype)
+        
+    def getNulls(self, records):
+        """
+            returns the null flags of records, a boolean array of a column per field
+        """
+        return numpy.unpackbits(records['nulls'], axis=1).astype(bool)
         
-    def toFile(self, filename):        
-        f = open(filename, 'w')
-        f.write(self.getTable())
-        f.close()         
+
+class VotableReader(object):
+    """
+        reads a votable with an incremental parser, the values of TABLEDATA,
+        BINARY or BINARY2 tables are decoded straight into numpy columns
+        typed by the datatypes of the fields, so memory is proportional 
+        to the columns and not to the document
+    """
+    #attributes of FIELD elements and of their Field object
+    fieldAttributes = {'name':'name', 'ucd':'ucd', 'utype':'utype', 'unit':'unit', 'ID':'id', 'id':'id',
+                       'datatype':'datatype', 'arraysize':'arraysize', 'width':'width', 
+                       'precision':'precision', 'xtype':'xtype', 'ref':'ref'}
+    #attributes of LINK elements and of their Link object
+    linkAttributes = {'ID':'id', 'content-role':'contentRole', 'content-type':'contentType', 
+                      'title':'title', 'value':'value', 'href':'href', 'action':'action'}
+    #number of bytes given to the parser at once
+    readSize = 1 << 20
+    
+    def __init__(self):
+        #table being read
+        self.table = None
+        #number of rows announced by the nrows attribute, None if missing
+        self.rows = None
+        #number of rows decoded
+        self.size = 0
+        #field being read
+        self.field = None
+        #characters of the element being read, None outside TD and DESCRIPTION
+        self.text = None
+        #values of the row being read
+        self.row = None
+        #rows of text not decoded yet
+        self.block = []
+        #decoder of the current BINARY or BINARY2 stream
+        self.decoder = None
+        #True once the first table is read
+        self.done = False
+        
+    @staticmethod
+    def fromFile(filename):
+        """
+            returns the Votable read from filename, decompressed according
+            to its extension
+        """
+        f = comp.openInput(filename)
+        try:
+            return VotableReader().read(f)
+        finally:
+            f.close()
+            
+    @staticmethod
+    def getDtype(field):
+        """
+            returns the numpy type of the column of field
+        """
+        if field.datatype == 'char' and (field.arraysize is None or not field.arraysize.isdigit()):
+            return numpy.dtype(object)
+        return numpy.dtype(BinaryEncoder.getDtype(field)).newbyteorder('=')
+        
+    def read(self, f):
+        """
+            returns the first table of the open file f,
+            with its fields and a numpy array per column
+        """
+        parser = xml.parsers.expat.ParserCreate()
+        parser.returns_unicode = False
+        parser.buffer_text = True
+        parser.StartElementHandler = self.__start
+        parser.EndElementHandler = self.__end
+        parser.CharacterDataHandler = self.__characters
+        while True:
+            data = f.read(VotableReader.readSize)
+            if len(data) == 0:
+                break
+            parser.Parse(data, False)
+        parser.Parse('', True)
+        if self.table is None:
+            raise Exception("no table found")
+        return self.table
+        
+    def __start(self, name, attributes):
+        #only the first table is read
+        if self.done:
+            return
+        if name == 'TABLE':
+            self.table = Votable()
+            if 'nrows' in attributes:
+                self.rows = int(attributes['nrows'])
+        elif name == 'FIELD':
+            self.field = Field()
+            for key, value in attributes.items():
+                if key in VotableReader.fieldAttributes:
+                    setattr(self.field, VotableReader.fieldAttributes[key], value)
+        elif name == 'LINK' and self.field is not None:
+            link = Link()
+            for key, value in attributes.items():
+                if key in VotableReader.linkAttributes:
+                    setattr(link, VotableReader.linkAttributes[key], value)
+            self.field.link = link
+        elif name in ('DESCRIPTION', 'TD'):
+            self.text = []
+        elif name == 'TR':
+            self.row = []
+        elif name == 'TABLEDATA':
+            self.__allocate()
+        elif name in (cfg.binarySerialization, cfg.binary2Serialization):
+            self.__allocate()
+            self.decoder = BinaryDecoder(self.table.fields, name == cfg.binary2Serialization)
+        
+    def __end(self, name):
+        if self.done:
+            return
+        if name == 'TABLE':
+            self.done = True
+        elif name == 'FIELD':
+            self.table.addField(self.field)
+            self.field = None
+        elif name == 'DESCRIPTION':
+            if self.field is not None:
+                self.field.description = ''.join(self.text)
+            self.text = None
+        elif name == 'TD':
+            self.row.append(''.join(self.text))
+            self.text = None
+        elif name == 'TR':
+            self.block.append(self.row)
+            if len(self.block) >= cfg.formatRows:
+                self.__decodeRows()
+        elif name == 'TABLEDATA':
+            self.__decodeRows()
+            self.__trim()
+        elif name in (cfg.binarySerialization, cfg.binary2Serialization):
+            self.decoder = None
+            self.__trim()
+            
+    def __characters(self, data):
+        if self.text is not None:
+            self.text.append(data)
+        elif self.decoder is not None:
+            self.__decodeRecords(self.decoder.decode(data))
+            
+    def __allocate(self):
+        """
+            creates a column per field, of the announced number of rows
+        """
+        size = 1024
+        if self.rows is not None:
+            size = self.rows
+        for field in self.table.fields:
+            self.table.addColumn(numpy.empty(size, dtype=VotableReader.getDtype(field)))
+            
+    def __reserve(self, rows):
+        """
+            enlarges the columns if rows more rows do not fit
+        """
+        capacity = len(self.table.columns[0])
+        if self.size+rows <= capacity:
+            return
+        capacity = max(2*capacity, self.size+rows)
+        for i in range(0, len(self.table.columns)):
+            column = numpy.empty(capacity, dtype=self.table.columns[i].dtype)
+            column[0:self.size] = self.table.columns[i][0:self.size]
+            self.table.columns[i] = column
+            
+    def __trim(self):
+        """
+            removes the unused end of the columns
+        """
+        for i in range(0, len(self.table.columns)):
+            if len(self.table.columns[i]) != self.size:
+                self.table.columns[i] = self.table.columns[i][0:self.size].copy()
+            
+    def __decodeRows(self):
+        """
+            converts the text of the rows read in TABLEDATA
+        """
+        rows = len(self.block)
+        if rows == 0 or len(self.table.columns) == 0:
+            return
+        self.__reserve(rows)
+        for j in range(0, len(self.table.columns)):
+            column = self.table.columns[j]
+            values = [row[j] for row in self.block]
+            if column.dtype.kind == 'f':
+                try:
+                    values = numpy.array(values).astype(column.dtype)
+                except ValueError:
+                    #empty cells are null values
+                    values = numpy.array([value.strip() or 'nan' for value in values]).astype(column.dtype)
+            elif column.dtype.kind != 'O':
+                values = numpy.array(values).astype(column.dtype)
+            column[self.size:self.size+rows] = values
+        self.size += rows
+        self.block = []
+        
+    def __decodeRecords(self, records):
+        """
+            copies the records decoded from a binary stream in the columns
+        """
+        rows = len(records)
+        if rows == 0:
+            return
+        self.__reserve(rows)
+        nulls = None
+        if self.decoder.binary2:
+            nulls = self.decoder.getNulls(records)
+        for j in range(0, len(self.table.columns)):
+            column = self.table.columns[j]
+            column[self.size:self.size+rows] = records['f'+str(j)]
+            if nulls is not None and column.dtype.kind == 'f':
+                column[self.size:self.size+rows][nulls[:, j]] = numpy.nan
+        self.size += rows